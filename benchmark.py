@@ -0,0 +1,661 @@
+"""
+Benchmarks for the performance-sensitive parts of the project, run on synthetic data.
+
+Each benchmark reports the wall time of the measured function and the peak memory it allocated
+(measured separately with tracemalloc, which slows the code down).
+
+The `stages` benchmark generates input files compatible with the configuration schema, runs every
+ETL and Model stage on them, and can save its results as a baseline or compare them with a saved
+baseline, flagging the stages which became slower or use more memory. Each stage is run once to
+warm up, then timed over several runs; the median time is compared, and a stage is only flagged
+on time when it is both slower than the tolerance and slower by more than a few milliseconds.
+
+Usage:
+    python benchmark.py stages --firms 1000 100000 --countries 20 250 --save-baseline baseline.json
+    python benchmark.py stages --firms 1000 100000 --countries 20 250 --compare baseline.json
+    python benchmark.py stages --compare baseline.json --repeat 7 --min-ms 10
+    python benchmark.py country_summary
+    python benchmark.py sqlite_export
+    python benchmark.py boot --repeat 5
+    python benchmark.py memory --firms 1000000 --countries 250
+
+The `boot` benchmark measures the start-up of the dashboard in fresh interpreters, with the current
+configuration: the import of the app modules and the first run of the app script (data loading and
+first render, without any Streamlit cache), and lists the slowest modules imported by the app.
+
+The `memory` benchmark runs the ETL on synthetic files with the compact company records of the
+configuration and with the previous layout (object strings, float64 values, every intermediate
+dataframe kept), and reports the memory held by each dataframe of the ETL in both cases.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import copy
+import shutil
+import argparse
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+import contextlib
+import numpy as np
+import pandas as pd
+import yaml
+
+from sqlalchemy import create_engine
+from constants import input_dir, output_path, config_file
+from database import get_engine, write_tables
+from etl import Etl
+from model import Model
+from configuration import get_config
+from repository import Repository
+
+# Number of synthetic rows used by the benchmarks
+BENCHMARK_SIZES = [10_000, 100_000, 1_000_000]
+
+# Default scales of the stages benchmark
+BENCHMARK_FIRMS = [1_000, 100_000]
+BENCHMARK_COUNTRIES = [20, 250]
+
+# Folder of the project modules
+PROJECT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+# Code timed by the boot benchmark in a fresh interpreter: (setup, measured statement, whether the
+# statement writes the outputs and runs in a temporary copy of the input folder)
+BOOT_STAGES = {
+    'import': ('pass', 'import main', False),
+    'first_run': ('import importlib.util\nfrom streamlit.testing.v1 import AppTest',
+                  "AppTest.from_file(importlib.util.find_spec('main').origin, default_timeout=3600).run()", True),
+}
+
+# Dataframes held by the ETL after a run
+ETL_FRAMES = ['df_financial_indicators_raw', 'df_largest_companies_raw', 'df_financial_indicators',
+              'df_largest_companies', 'df_largest_companies_aggregated', 'df_merged']
+
+# Value ranges of the generated numeric columns, in the order of the input file schemas
+FINANCIAL_INDICATORS_RANGES = [(0.1, 12), (-1, 10), (50, 300), (10, 200), (10, 35), (0.05, 30)]
+LARGEST_COMPANIES_RANGES = [(1e3, 6e5), (1e4, 5e6), (-1e3, 5e4)]
+INDUSTRIES = ['Banking', 'Insurance', 'Conglomerate', 'Investment', 'Energy', 'Retail', 'Technology',
+              'Automotive', 'Telecommunications', 'Pharmaceuticals', 'Real Estate', 'Utilities']
+
+
+def make_merged_data(config: dict, n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic merged dataset with the layout written by the ETL, one row per country/period.
+
+    :param config: the project configuration.
+    :param n_rows: the number of rows to generate.
+    :param seed: the random seed.
+    :return: the synthetic merged dataframe.
+    """
+
+    rng = np.random.default_rng(seed)
+    columns = config['merged_dataset']['columns']
+
+    return pd.DataFrame({
+        columns['country']: [f'country_{i}' for i in range(n_rows)],
+        columns['mean_revenue']: rng.uniform(1e3, 5e5, n_rows),
+        columns['mean_total_asset']: rng.uniform(1e4, 5e6, n_rows),
+        columns['mean_net_income']: rng.uniform(-1e3, 5e4, n_rows),
+        columns['interest_rate']: rng.uniform(0, 10, n_rows),
+        columns['inflation_rate']: rng.uniform(0, 10, n_rows),
+        columns['banking_sector_assets']: rng.uniform(50, 300, n_rows),
+        columns['stock_market_capitalization']: rng.uniform(10, 200, n_rows),
+        columns['corporate_tax_rate']: rng.uniform(10, 35, n_rows),
+        columns['gdp_usd_trillions']: rng.uniform(0.1, 30, n_rows),
+    })
+
+
+def make_financial_indicators(config: dict, n_countries: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic financial indicators file, with the raw columns of the configuration schema.
+
+    :param config: the project configuration.
+    :param n_countries: the number of countries to generate.
+    :param seed: the random seed.
+    :return: the synthetic financial indicators.
+    """
+
+    rng = np.random.default_rng(seed)
+    country, *columns = config['schema']['financial_indicators']
+
+    df = pd.DataFrame({country: [f'Country {i:03d}' for i in range(n_countries)]})
+    for column, (low, high) in zip(columns, FINANCIAL_INDICATORS_RANGES):
+        df[column] = rng.uniform(low, high, n_countries).round(2)
+
+    return df
+
+
+def make_largest_companies(config: dict, n_firms: int, n_countries: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic company file, with the raw columns of the configuration schema.
+
+    About 1% of the monetary values are zeros and 0.5% of the rows are duplicates,
+    so that the cleaning steps have some work to do.
+    :param config: the project configuration.
+    :param n_firms: the number of firms to generate.
+    :param n_countries: the number of headquarters countries.
+    :param seed: the random seed.
+    :return: the synthetic company data.
+    """
+
+    rng = np.random.default_rng(seed)
+    rank, company, industry, *monetary, headquarters = config['schema']['largest_companies']
+
+    df = pd.DataFrame({
+        rank: np.arange(1, n_firms + 1),
+        company: [f'Company {i:08d}' for i in range(n_firms)],
+        industry: rng.choice(INDUSTRIES, n_firms),
+    })
+    for column, (low, high) in zip(monetary, LARGEST_COMPANIES_RANGES):
+        values = rng.uniform(low, high, n_firms).round(2)
+        values[rng.random(n_firms) < 0.01] = 0
+        df[column] = values
+    df[headquarters] = [f'Country {i:03d}' for i in rng.integers(0, n_countries, n_firms)]
+
+    duplicates = df.sample(frac=0.005, random_state=seed)
+    return pd.concat([df, duplicates], ignore_index=True)
+
+
+def write_input_files(config: dict, folder: str, n_firms: int, n_countries: int, seed: int = 0) -> None:
+    """
+    Write both synthetic input files in a folder, under the names set in the configuration.
+
+    :param config: the project configuration.
+    :param folder: the destination folder.
+    :param n_firms: the number of firms to generate.
+    :param n_countries: the number of countries to generate.
+    :param seed: the random seed.
+    :return: none
+    """
+
+    input_files = config['input_files_csv']
+
+    make_financial_indicators(config, n_countries, seed).to_csv(
+        os.path.join(folder, input_files['source_financial_indicators']), index=False)
+    make_largest_companies(config, n_firms, n_countries, seed).to_csv(
+        os.path.join(folder, input_files['source_largest_companies']), index=False)
+
+
+def measure(func, trace_memory: bool = True, repeat: int = 1, warmup: int = 0) -> tuple:
+    """
+    Measure the wall time and the peak allocated memory of a function call.
+
+    The function is called `warmup` times without being measured, then timed `repeat` times,
+    then called once more under tracemalloc to measure the memory, so it must give the same
+    result when repeated.
+    :param func: the function to call, without arguments.
+    :param trace_memory: whether to measure the peak memory.
+    :param repeat: the number of timed calls.
+    :param warmup: the number of calls before the timed ones.
+    :return: the median and the minimum elapsed times in seconds, and the peak memory in MB
+             (NaN when not measured).
+    """
+
+    for _ in range(warmup):
+        func()
+
+    times = []
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    if not trace_memory:
+        return statistics.median(times), min(times), float('nan')
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return statistics.median(times), min(times), peak / 1e6
+
+
+def get_country_summary_with_merges(model: Model) -> pd.DataFrame:
+    """
+    Compute the country summary the way it was done before the single-pass version:
+    one copy of the merged data per metric, then three merges on the country column.
+
+    :param model: the model holding the repository data.
+    :return: the country-level summary.
+    """
+
+    country = model.col_merged['country']
+
+    df = Model.get_revenue_to_gdp.__wrapped__(model)
+    df = df.merge(Model.get_real_interest_rate.__wrapped__(model), on=country)
+    df = df.merge(Model.get_average_contribution_to_public_finances.__wrapped__(model), on=country)
+    df = df.merge(Model.get_average_roa_per_country.__wrapped__(model), on=country)
+
+    return df.round(3)
+
+
+def benchmark_country_summary(config: dict, sizes: list) -> pd.DataFrame:
+    """
+    Compare the merge-based and the single-pass country summaries on synthetic data.
+
+    :param config: the project configuration.
+    :param sizes: the numbers of rows to benchmark.
+    :return: one row per size and implementation with the time and peak memory.
+    """
+
+    results = []
+
+    for n_rows in sizes:
+        repo = Repository(config, backend='files')
+        repo.merged_data = make_merged_data(config, n_rows)
+        model = Model(config, repo)
+
+        implementations = {
+            'merges': lambda: get_country_summary_with_merges(model),
+            'single_pass': lambda: Model.get_country_financial_summary.__wrapped__(model),
+        }
+
+        for name, func in implementations.items():
+            elapsed, _, peak = measure(func)
+            results.append({'rows': n_rows, 'implementation': name, 'seconds': round(elapsed, 4),
+                            'peak_mb': round(peak, 1)})
+
+    return pd.DataFrame(results)
+
+
+def make_firms_summary(config: dict, n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generate a synthetic firms summary with the layout exported to SQLite.
+
+    :param config: the project configuration.
+    :param n_rows: the number of firms to generate.
+    :param seed: the random seed.
+    :return: the synthetic firms summary.
+    """
+
+    rng = np.random.default_rng(seed)
+    columns = config['firms_financial_summary_table']
+
+    return pd.DataFrame({
+        columns['company']: [f'company_{i}' for i in range(n_rows)],
+        columns['asset_efficiency']: rng.uniform(0, 5, n_rows).round(3),
+        columns['return_on_assets']: rng.uniform(-5, 10, n_rows).round(3),
+    })
+
+
+def benchmark_sqlite_export(config: dict, sizes: list) -> pd.DataFrame:
+    """
+    Compare the SQLite write throughput of `to_sql(if_exists='replace')` on a new engine
+    with the bulk writer used by `Model.export_datasets_to_sqlite`.
+
+    :param config: the project configuration.
+    :param sizes: the numbers of rows to benchmark.
+    :return: one row per size and implementation with the time and the rows per second.
+    """
+
+    export = config['export_final_results']
+    table = export['firms_summary_stat']
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        database_path = os.path.join(folder, 'benchmark.sqlite')
+
+        for n_rows in sizes:
+            df = make_firms_summary(config, n_rows)
+
+            implementations = {
+                'to_sql_replace': lambda: df.to_sql(table, con=create_engine(f'sqlite:///{database_path}'),
+                                                    if_exists='replace', index=False),
+                'bulk_writer': lambda: write_tables(get_engine(database_path), {table: df},
+                                                    indexes=export['indexes'], chunksize=export['chunksize']),
+            }
+
+            for name, func in implementations.items():
+                start = time.perf_counter()
+                func()
+                elapsed = time.perf_counter() - start
+                results.append({'rows': n_rows, 'implementation': name, 'seconds': round(elapsed, 4),
+                                'rows_per_second': int(n_rows / elapsed)})
+
+        get_engine(database_path).dispose()
+
+    return pd.DataFrame(results)
+
+
+def benchmark_stages(config: dict, n_firms: int, n_countries: int, trace_memory: bool = True, repeat: int = 5,
+                     warmup: int = 1) -> pd.DataFrame:
+    """
+    Run every ETL and Model stage on synthetic input files and measure each of them.
+
+    The ETL options of the configuration (CSV engine, output format, ...) are used as they are,
+    except the input and output locations which are moved to a temporary folder.
+    :param config: the project configuration.
+    :param n_firms: the number of firms to generate.
+    :param n_countries: the number of countries to generate.
+    :param trace_memory: whether to measure the peak memory of each stage.
+    :param repeat: the number of timed runs of each stage.
+    :param warmup: the number of runs of each stage before the timed ones.
+    :return: one row per stage with the median and minimum times, the peak memory and the number
+             of rows produced.
+    """
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as folder:
+        config = {**config, 'folders': {**config['folders'], 'output_folder': folder}}
+        write_input_files(config, folder, n_firms, n_countries)
+
+        etl = Etl(config=config, input_dir=folder)
+        repo = Repository(config, folder, columns=Model.get_required_columns(config), backend='files',
+                          database_path=os.path.join(folder, 'benchmark.sqlite'))
+        model = Model(config, repo)
+
+        stages = {
+            'extract': (etl.extract, lambda: etl.df_largest_companies_raw),
+            'clean_data': (etl.clean_data, lambda: etl.df_largest_companies),
+            'aggregate_data': (etl.aggregate_data, lambda: etl.df_largest_companies_aggregated),
+            'merge_data': (etl.merge_data, lambda: etl.df_merged),
+            'sort_countries_by_total_assets': (etl.sort_countries_by_total_assets, lambda: etl.df_merged),
+            'load': (etl.load, lambda: etl.df_merged),
+            'repository_get_data': (repo.get_data, lambda: repo.largest_companies),
+            'get_country_financial_summary': (
+                lambda: Model.get_country_financial_summary.__wrapped__(model),
+                lambda: Model.get_country_financial_summary.__wrapped__(model)),
+            'get_firms_financial_summary': (
+                lambda: Model.get_firms_financial_summary.__wrapped__(model),
+                lambda: repo.largest_companies),
+            'export_datasets_to_sqlite': (
+                lambda: model.export_datasets_to_sqlite(repo.database_path),
+                lambda: repo.largest_companies),
+        }
+
+        for stage, (func, output) in stages.items():
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, fastest, peak = measure(func, trace_memory, repeat, warmup)
+
+            results.append({'firms': n_firms, 'countries': n_countries, 'stage': stage,
+                            'seconds': round(elapsed, 4), 'min_seconds': round(fastest, 4),
+                            'peak_mb': round(peak, 1), 'rows': len(output())})
+
+        get_engine(repo.database_path).dispose()
+
+    return pd.DataFrame(results)
+
+
+def measure_in_subprocess(setup: str, statement: str, cwd: str = PROJECT_FOLDER) -> float:
+    """
+    Time a statement in a new Python interpreter, so no module is already imported or cached.
+
+    :param setup: code run before the measure.
+    :param statement: the code measured.
+    :param cwd: the working folder of the interpreter, the project modules stay importable from it.
+    :return: the wall time of the statement in seconds.
+    """
+
+    code = f'import time\n{setup}\nstart = time.perf_counter()\n{statement}\nprint(time.perf_counter() - start)'
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [PROJECT_FOLDER, os.environ.get('PYTHONPATH')]))}
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=cwd,
+                            env=env)
+
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def copy_input_folder(folder: str) -> None:
+    """
+    Copy the input folder of the project into a folder, with the output folder of the copied
+    configuration moved inside it.
+
+    :param folder: the destination folder, used as the working folder of the copy.
+    :return: none
+    """
+
+    input_folder = os.path.join(folder, input_dir)
+    shutil.copytree(os.path.join(PROJECT_FOLDER, input_dir), input_folder)
+
+    config_path = os.path.join(folder, config_file)
+    with open(config_path) as file:
+        config = yaml.safe_load(file)
+    config['folders'] = {**config['folders'], 'output_folder': os.path.join(folder, output_path)}
+    with open(config_path, 'w') as file:
+        yaml.safe_dump(config, file, sort_keys=False, allow_unicode=True)
+
+
+def benchmark_boot(repeat: int) -> pd.DataFrame:
+    """
+    Measure the start-up stages of the dashboard, each in `repeat` fresh interpreters.
+
+    The stages writing the outputs run in a new temporary folder each time, with a copy of the input
+    folder whose configuration sets the output folder inside it, so each run is a first run and the
+    outputs and the log of the project are left untouched.
+    :param repeat: the number of runs per stage.
+    :return: the median, minimum and maximum times of each stage.
+    """
+
+    rows = []
+
+    for stage, (setup, statement, isolated) in BOOT_STAGES.items():
+        times = []
+
+        for _ in range(repeat):
+            if not isolated:
+                times.append(measure_in_subprocess(setup, statement))
+                continue
+
+            with tempfile.TemporaryDirectory() as folder:
+                copy_input_folder(folder)
+                times.append(measure_in_subprocess(setup, statement, cwd=folder))
+
+        rows.append({'stage': stage, 'runs': repeat, 'median_seconds': round(statistics.median(times), 3),
+                     'min_seconds': round(min(times), 3), 'max_seconds': round(max(times), 3)})
+
+    return pd.DataFrame(rows)
+
+
+def get_import_times(module: str = 'main', top: int = 10) -> pd.DataFrame:
+    """
+    List the slowest modules imported directly by a module, with `python -X importtime`.
+
+    :param module: the imported module.
+    :param top: the number of modules listed.
+    :return: the cumulative import time of each module, slowest first.
+    """
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True,
+                            text=True, check=True, cwd=PROJECT_FOLDER)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        # Lines look like "import time:  self [us] | cumulative |   name", indented by 2 per nesting level
+        parts = line.split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        if name.startswith('  ') and not name.startswith('   '):
+            rows.append({'module': name.strip(), 'cumulative_seconds': int(parts[1]) / 1e6})
+
+    df = pd.DataFrame(rows, columns=['module', 'cumulative_seconds'])
+
+    return df.sort_values('cumulative_seconds', ascending=False).head(top).round(3).reset_index(drop=True)
+
+
+def is_text_dtype(dtype: str) -> bool:
+    """
+    Tell whether a schema dtype stores text, as strings or as categories.
+
+    :param dtype: the dtype name of a schema column.
+    :return: True for the string and category dtypes.
+    """
+
+    return dtype == 'category' or pd.api.types.is_string_dtype(pd.api.types.pandas_dtype(dtype))
+
+
+def get_previous_layout(config: dict) -> dict:
+    """
+    Build a configuration storing the company records as before the compact layout: every text
+    column, categorical ones included, as Python objects, float64 monetary values and every
+    intermediate dataframe kept.
+
+    :param config: the project configuration.
+    :return: the modified copy of the configuration.
+    """
+
+    config = copy.deepcopy(config)
+    config['etl']['compact'] = {**config['etl']['compact'], 'float32_columns': [], 'release_frames': False}
+
+    for name in ('largest_companies', 'largest_companies_output'):
+        config['schema'][name] = {column: 'object' if is_text_dtype(dtype) else dtype
+                                  for column, dtype in config['schema'][name].items()}
+
+    return config
+
+
+def benchmark_memory(config: dict, n_firms: int, n_countries: int) -> tuple:
+    """
+    Compare the memory held by the ETL dataframes with the compact and the previous layouts.
+
+    :param config: the project configuration.
+    :param n_firms: the number of firms to generate.
+    :param n_countries: the number of countries to generate.
+    :return: the MB held by each dataframe and in total for both layouts, and the MB of each column
+             of the cleaned company records.
+    """
+
+    layouts = {'previous': get_previous_layout(config), 'compact': config}
+    frames = {}
+    columns = {}
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_input_files(config, folder, n_firms, n_countries)
+
+        for layout, layout_config in layouts.items():
+            layout_config = {**layout_config, 'folders': {**layout_config['folders'], 'output_folder': folder}}
+
+            etl = Etl(config=layout_config, input_dir=folder)
+            with contextlib.redirect_stdout(io.StringIO()):
+                etl.extract()
+                etl.transform()
+
+            frames[layout] = {name: getattr(etl, name).memory_usage(deep=True).sum() / 1e6 for name in ETL_FRAMES}
+            columns[layout] = etl.df_largest_companies.memory_usage(deep=True, index=False) / 1e6
+
+    df_frames = pd.DataFrame(frames)
+    df_frames.loc['total'] = df_frames.sum()
+    df_columns = pd.DataFrame(columns)
+
+    for df in (df_frames, df_columns):
+        df['ratio'] = df['compact'] / df['previous']
+
+    return df_frames.round(3), df_columns.round(3)
+
+
+def compare_with_baseline(results: pd.DataFrame, baseline: pd.DataFrame, tolerance: float,
+                          min_ms: float = 5.0) -> pd.DataFrame:
+    """
+    Compare benchmark results with a saved baseline.
+
+    A stage is flagged as a regression when its peak memory exceeds the baseline by more than
+    `tolerance` (as a fraction of the baseline value), or when its median time exceeds the
+    baseline both by more than `tolerance` and by more than `min_ms` milliseconds, so the
+    timer noise of the stages taking a few milliseconds is never flagged.
+    :param results: the new results of `benchmark_stages`.
+    :param baseline: the saved results.
+    :param tolerance: the accepted relative increase, e.g. 0.2 for 20%.
+    :param min_ms: the accepted absolute increase of the time, in milliseconds.
+    :return: the results with the baseline values, their ratios and a regression flag.
+    """
+
+    keys = ['firms', 'countries', 'stage']
+    df = results.merge(baseline[keys + ['seconds', 'peak_mb']], on=keys, how='left', suffixes=('', '_baseline'))
+
+    df['time_ratio'] = (df['seconds'] / df['seconds_baseline']).round(2)
+    df['memory_ratio'] = (df['peak_mb'] / df['peak_mb_baseline']).round(2)
+    slower = df['seconds'] - df['seconds_baseline']
+    df['regression'] = (((df['seconds'] > df['seconds_baseline'] * (1 + tolerance)) & (slower > min_ms / 1000))
+                        | (df['memory_ratio'] > 1 + tolerance))
+
+    return df
+
+
+def main() -> int:
+    """
+    Run the benchmark selected on the command line.
+    :return: the exit code, 1 if a regression was found.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmark', nargs='?', default='stages',
+                        choices=['stages', 'country_summary', 'sqlite_export', 'boot', 'memory'])
+    parser.add_argument('--firms', type=int, nargs='+', default=BENCHMARK_FIRMS,
+                        help='numbers of firms to generate (stages, memory)')
+    parser.add_argument('--countries', type=int, nargs='+', default=BENCHMARK_COUNTRIES,
+                        help='numbers of countries to generate (stages, memory)')
+    parser.add_argument('--rows', type=int, nargs='+', default=BENCHMARK_SIZES,
+                        help='numbers of rows to generate (country_summary, sqlite_export)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of timed runs (stages) or fresh interpreters (boot) per stage (default: 5)')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='number of untimed runs of each stage before the timed ones (stages, default: 1)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory measurement')
+    parser.add_argument('--save-baseline', help='save the results of the stages benchmark to this JSON file')
+    parser.add_argument('--compare', help='compare the results of the stages benchmark with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative increase flagged as a regression (default: 0.2)')
+    parser.add_argument('--min-ms', type=float, default=5.0,
+                        help='time increase in milliseconds under which no time regression is flagged (default: 5)')
+    args = parser.parse_args()
+
+    config = get_config()
+    pd.set_option('display.width', 200)
+
+    if args.benchmark == 'country_summary':
+        print(benchmark_country_summary(config, args.rows).to_string(index=False))
+        return 0
+
+    if args.benchmark == 'sqlite_export':
+        print(benchmark_sqlite_export(config, args.rows).to_string(index=False))
+        return 0
+
+    if args.benchmark == 'memory':
+        for n_firms in args.firms:
+            for n_countries in args.countries:
+                df_frames, df_columns = benchmark_memory(config, n_firms, n_countries)
+                print(f'{n_firms} firms, {n_countries} countries: memory held by the ETL (MB)')
+                print(df_frames.to_string())
+                print(df_columns.to_string())
+                print()
+        return 0
+
+    if args.benchmark == 'boot':
+        print(benchmark_boot(args.repeat).to_string(index=False))
+        print()
+        print(get_import_times().to_string(index=False))
+        return 0
+
+    results = pd.concat([benchmark_stages(config, n_firms, n_countries, trace_memory=not args.no_memory,
+                                          repeat=args.repeat, warmup=args.warmup)
+                         for n_firms in args.firms for n_countries in args.countries], ignore_index=True)
+
+    if args.save_baseline:
+        with open(args.save_baseline, mode='w', encoding='utf-8') as file:
+            json.dump(results.to_dict(orient='records'), file, indent=2)
+
+    if not args.compare:
+        print(results.to_string(index=False))
+        return 0
+
+    with open(args.compare, mode='r', encoding='utf-8') as file:
+        baseline = pd.DataFrame(json.load(file))
+
+    comparison = compare_with_baseline(results, baseline, args.tolerance, args.min_ms)
+    print(comparison.to_string(index=False))
+
+    regressions = comparison[comparison['regression']]
+    if not regressions.empty:
+        print(f'{len(regressions)} regression(s): {", ".join(regressions["stage"].unique())}')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
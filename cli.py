@@ -0,0 +1,221 @@
+"""
+Command line entry point running the whole pipeline headlessly: the ETL, the summaries of the Model
+and their export to the SQLite database (or to a new snapshot), so the dashboard processes only
+read the results.
+
+The pipeline can run once, on a fixed schedule, or in a watch loop which reruns it whenever one of
+the input files or the configuration changes.
+
+Usage:
+    python cli.py                                   # run once with the configuration file settings
+    python cli.py --engine duckdb --workers 4       # override the ETL settings
+    python cli.py --input-dir data --output-dir out --incremental
+    python cli.py --dry-run                         # show what would be processed, write nothing
+    python cli.py --every 3600                      # run every hour
+    python cli.py --watch --poll 10                 # run when the inputs change, checked every 10 s
+"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+
+from constants import config_file
+from helpers import get_cached_files_hash
+from configuration import Config
+from logger import Logger
+from instrumentation import configure as configure_instrumentation
+
+
+def get_arguments(argv: list = None) -> argparse.Namespace:
+    """
+    Parse the command line.
+
+    :param argv: the arguments, defaults to the ones of the process.
+    :return: the parsed arguments.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=config_file, help=f'configuration file (default: {config_file})')
+    parser.add_argument('--input-dir', help='folder of the input files (default: folders.input_folder)')
+    parser.add_argument('--output-dir', help='folder of the outputs and database (default: folders.output_folder)')
+    parser.add_argument('--engine', choices=['pandas', 'sqlite', 'duckdb'], help='engine of the ETL steps')
+    parser.add_argument('--workers', type=int, help='number of processes for the company shards')
+    parser.add_argument('--incremental', action=argparse.BooleanOptionalAction, default=None,
+                        help='only process the company rows appended since the previous run')
+    parser.add_argument('--snapshot', action=argparse.BooleanOptionalAction, default=None,
+                        help='publish the results as a new snapshot instead of the database '
+                             '(default: snapshot.enabled)')
+    parser.add_argument('--force', action='store_true', help='build a snapshot even if it is up to date')
+    parser.add_argument('--dry-run', action='store_true', help='show the inputs, mode and outputs, then exit')
+
+    schedule = parser.add_mutually_exclusive_group()
+    schedule.add_argument('--every', type=float, metavar='SECONDS', help='rerun the pipeline at this interval')
+    schedule.add_argument('--watch', action='store_true', help='rerun the pipeline when the inputs change')
+    parser.add_argument('--poll', type=float, default=5.0, metavar='SECONDS',
+                        help='interval between two checks of the inputs in watch mode (default: 5)')
+
+    return parser.parse_args(argv)
+
+
+def get_run_config(args: argparse.Namespace) -> Config:
+    """
+    Load the configuration file and apply the command line overrides.
+
+    :param args: the parsed arguments.
+    :return: the configuration of the run.
+    """
+
+    # A private copy, the overrides must not change the configuration shared by the process
+    config = Config(args.config)
+
+    if args.input_dir is not None:
+        config['folders']['input_folder'] = args.input_dir
+    if args.output_dir is not None:
+        config['folders']['output_folder'] = args.output_dir
+    if args.engine is not None:
+        config['etl']['engine'] = args.engine
+    if args.workers is not None:
+        config['etl']['workers'] = args.workers
+    if args.incremental is not None:
+        config['etl']['incremental'] = args.incremental
+    if args.snapshot is not None:
+        config['snapshot']['enabled'] = args.snapshot
+
+    return config
+
+
+def get_inputs_hash(config: Config, config_path: str) -> str:
+    """
+    Hash the input files of the ETL and the configuration file.
+
+    The files are only read again when their modification time or size changed since the last call.
+    :param config: the configuration of the run.
+    :param config_path: the configuration file.
+    :return: the content hash, which changes when an input is modified, added or removed.
+    """
+
+    from etl import Etl
+
+    etl = Etl(config=config, input_dir=config.input_folder)
+
+    return get_cached_files_hash([config_path] + etl.get_input_paths())
+
+
+def describe_run(config: Config) -> list:
+    """
+    Describe what a run would read and write, without processing anything.
+
+    :param config: the configuration of the run.
+    :return: the lines of the description.
+    """
+
+    from etl import Etl
+
+    etl = Etl(config=config, input_dir=config.input_folder)
+    lines = [f'mode: {etl.get_run_mode()} (engine: {config["etl"]["engine"]}, '
+             f'workers: {config["etl"]["workers"] or "all cores"})',
+             'inputs:']
+
+    for path in etl.get_input_paths():
+        size = f'{os.path.getsize(path) / 1e6:.1f} MB' if os.path.exists(path) else 'missing'
+        lines.append(f'  {path} ({size})')
+
+    lines.append(f'outputs: {config.output_folder} ({config.output_format})')
+
+    if config['snapshot']['enabled']:
+        from snapshot import get_snapshot_folder
+        lines.append(f'export: new snapshot in {get_snapshot_folder(config)}')
+    else:
+        lines.append(f'export: {config.database_path} ({config["export_final_results"]["mode"]})')
+
+    return lines
+
+
+def run_pipeline(config: Config, config_path: str, force: bool = False) -> bool:
+    """
+    Run the ETL, compute the summaries and export them, to the database or to a new snapshot.
+
+    :param config: the configuration of the run.
+    :param config_path: the configuration file, hashed with the inputs of a snapshot.
+    :param force: build a snapshot even if the current one is up to date.
+    :return: True if the results were exported.
+    """
+
+    if config['snapshot']['enabled']:
+        from snapshot import build_snapshot
+
+        snapshot = build_snapshot(config, force=force, input_folder=config.input_folder,
+                                  config_path=config_path)
+        if snapshot is None:
+            return False
+
+        print(f'current snapshot: {snapshot["version"]} ({snapshot["path"]})')
+        return True
+
+    from etl import Etl
+    from model import Model
+    from repository import Repository
+
+    output_folder = config.output_folder
+
+    etl = Etl(config=config, input_dir=config.input_folder)
+    etl.run()
+    logging.info('ETL completed')
+
+    # The export reads the files just written by the ETL, not the database being replaced
+    repo = Repository(config, output_folder, columns=Model.get_required_columns(config), backend='files')
+    repo.get_data()
+
+    if not Model(config, repo).export_datasets_to_sqlite(config.database_path):
+        return False
+
+    print(f'results exported to {config.database_path}')
+    return True
+
+
+def main(argv: list = None) -> int:
+    """
+    Run the pipeline once, on a schedule or in a watch loop, as set on the command line.
+
+    :param argv: the arguments, defaults to the ones of the process.
+    :return: the exit code, 1 if a single run failed.
+    """
+
+    args = get_arguments(argv)
+    config = get_run_config(args)
+
+    if args.dry_run:
+        print('\n'.join(describe_run(config)))
+        return 0
+
+    Logger(config).set_log()
+    configure_instrumentation(config)
+
+    if args.every is None and not args.watch:
+        return 0 if run_pipeline(config, args.config, force=args.force) else 1
+
+    last_hash = None
+
+    try:
+        while True:
+            # On a schedule the pipeline always runs, so the inputs are not hashed; in watch mode
+            # only when an input changed
+            inputs_hash = None if args.every is not None else get_inputs_hash(config, args.config)
+
+            if args.every is not None or inputs_hash != last_hash:
+                started = time.strftime('%Y-%m-%d %H:%M:%S')
+                if run_pipeline(config, args.config, force=args.force):
+                    last_hash = inputs_hash
+                else:
+                    print(f'[Error] the run started at {started} failed')
+                    logging.error(f'the run started at {started} failed')
+
+            time.sleep(args.every if args.every is not None else args.poll)
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
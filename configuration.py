@@ -0,0 +1,175 @@
+"""
+This module loads the project configuration once per process.
+
+`get_config` returns a shared `Config`, parsed and validated on the first call and only reloaded
+when the modification time of the file changes. A `Config` is the configuration dictionary itself,
+so existing `config['section'][...]` lookups keep working, with typed attributes for the values
+read on every page render and the column rename maps of the dashboard tables precomputed.
+"""
+
+import os
+
+from constants import config_file
+from helpers import get_serialized_data
+
+# Sections every configuration must define
+REQUIRED_SECTIONS = ['folders', 'logger', 'instrumentation', 'input_files_csv', 'schema', 'output_files_csv', 'etl',
+                     'panel', 'largest_companies', 'merged_dataset', 'export_final_results', 'repository',
+                     'snapshot', 'watcher', 'countries_financial_summary_table', 'firms_financial_summary_table',
+                     'streamlit', 'plot_roa_vs_efficiency', 'plot_contribution_vs_roa',
+                     'plot_macro_correlation_heatmap', 'display_country_table', 'display_firms_table']
+
+# Accepted values of the settings with a fixed set of choices: (section, key) -> choices
+CHOICES = {
+    ('etl', 'engine'): ['pandas', 'sqlite', 'duckdb'],
+    ('output_files_csv', 'format'): ['csv', 'parquet', 'feather'],
+    ('repository', 'backend'): ['files', 'sqlite'],
+    ('export_final_results', 'mode'): ['replace', 'upsert'],
+    ('plot_macro_correlation_heatmap', 'method'): ['pearson', 'spearman'],
+}
+
+# Numeric settings and their lowest accepted value: (section, key) -> (minimum, null allowed)
+MINIMUMS = {
+    ('etl', 'chunksize'): (1, True),
+    ('etl', 'workers'): (1, True),
+    ('etl', 'staging_chunksize'): (1, False),
+    ('export_final_results', 'chunksize'): (1, False),
+    ('snapshot', 'keep'): (1, False),
+    ('watcher', 'poll_interval'): (0.01, False),
+    ('watcher', 'debounce'): (0, False),
+}
+
+# Parsed configurations by absolute path
+_configs = {}
+
+
+class Config(dict):
+    """
+    The project configuration, with typed attributes for the most used settings.
+
+    Instances returned by `get_config` are shared by the whole process and must not be modified;
+    build a new `Config` to change settings, as the command line does. The attributes read the
+    dictionary, except the rename maps of the displayed labels which are computed once.
+    """
+
+    def __init__(self, path: str = config_file) -> None:
+        """
+        Parse and validate a configuration file.
+
+        :param path: the YAML, JSON or TOML configuration file.
+        :raises ValueError: if the file format is not supported or the configuration is invalid.
+        """
+
+        self.path = os.path.abspath(path)
+        self.modified_ns = os.stat(self.path).st_mtime_ns
+        super().__init__(get_serialized_data(self.path))
+
+        errors = self.get_errors()
+        if errors:
+            raise ValueError(f'Invalid configuration {path}: ' + '; '.join(errors))
+
+        # Column name -> displayed label, for the tables and the heatmap of the dashboard
+        self.country_table_names: dict = self.get_rename_map('countries_financial_summary_table',
+                                                             self['display_country_table'])
+        self.firms_table_names: dict = self.get_rename_map('firms_financial_summary_table',
+                                                           self['display_firms_table'])
+        self.macro_correlation_labels: dict = self.get_rename_map('countries_financial_summary_table',
+                                                                  self['plot_macro_correlation_heatmap']['labels'])
+
+    @property
+    def input_folder(self) -> str:
+        return self['folders']['input_folder']
+
+    @property
+    def output_folder(self) -> str:
+        return self['folders']['output_folder']
+
+    @property
+    def database_path(self) -> str:
+        return os.path.join(self['folders']['output_folder'], self['folders']['database_path'])
+
+    @property
+    def engine(self) -> str:
+        return self['etl']['engine']
+
+    @property
+    def output_format(self) -> str:
+        return self['output_files_csv']['format']
+
+    @property
+    def backend(self) -> str:
+        return self['repository']['backend']
+
+    @property
+    def panel_enabled(self) -> bool:
+        return bool(self['panel']['enabled'])
+
+    @property
+    def widgets(self) -> dict:
+        return self['streamlit']['widgets']
+
+    def get_rename_map(self, table: str, labels: dict) -> dict:
+        """
+        Map the columns of a summary table to their displayed labels.
+
+        :param table: the section naming the columns of the table.
+        :param labels: mapping of the column keys of the table to their labels.
+        :return: mapping of the column names to the labels.
+        """
+
+        return {self[table][key]: label for key, label in labels.items()}
+
+    def get_errors(self) -> list:
+        """
+        Check the sections, the settings with fixed choices, the numeric settings and the keys of
+        the displayed labels.
+        :return: the description of each problem found.
+        """
+
+        missing = [section for section in REQUIRED_SECTIONS if section not in self]
+        if missing:
+            return [f'missing sections {", ".join(missing)}']
+
+        errors = []
+
+        for (section, key), choices in CHOICES.items():
+            if self[section].get(key) not in choices:
+                errors.append(f'{section}.{key} is {self[section].get(key)!r}, expected one of {", ".join(choices)}')
+
+        for (section, key), (minimum, nullable) in MINIMUMS.items():
+            value = self[section].get(key)
+            if value is None and nullable:
+                continue
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < minimum:
+                errors.append(f'{section}.{key} is {value!r}, expected a number >= {minimum}')
+
+        displayed = [('display_country_table', 'countries_financial_summary_table', self['display_country_table']),
+                     ('display_firms_table', 'firms_financial_summary_table', self['display_firms_table']),
+                     ('plot_macro_correlation_heatmap.labels', 'countries_financial_summary_table',
+                      self['plot_macro_correlation_heatmap']['labels'])]
+
+        for name, table, labels in displayed:
+            unknown = [key for key in labels if key not in self[table]]
+            if unknown:
+                errors.append(f'{name} has keys {", ".join(unknown)} which are not columns of {table}')
+
+        return errors
+
+
+def get_config(path: str = config_file) -> Config:
+    """
+    Return the shared configuration of a file, parsed on the first call and reloaded only when
+    the file was modified since.
+
+    :param path: the configuration file, relative to the working directory.
+    :return: the configuration.
+    """
+
+    full_path = os.path.abspath(path)
+    config = _configs.get(full_path)
+
+    if config is None or os.stat(full_path).st_mtime_ns != config.modified_ns:
+        config = Config(full_path)
+        _configs[full_path] = config
+
+    return config
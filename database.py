@@ -0,0 +1,237 @@
+from contextlib import nullcontext
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, Connection
+
+# One engine (and its connection pool) per database file, shared by the whole process
+_engines = {}
+
+
+def get_engine(database_path: str) -> Engine:
+    """
+    Return the pooled SQLAlchemy engine of a SQLite database, creating it on first use.
+
+    Connections are opened in WAL journal mode, so readers keep seeing the previous version
+    of the tables while an export is being written. The transactions are started by SQLAlchemy
+    with an explicit BEGIN instead of by pysqlite, which only opens one before the first INSERT:
+    the CREATE, DROP and ALTER statements of a transaction are then committed or rolled back
+    with its rows.
+    :param database_path: path to the SQLite database file.
+    :return: the engine.
+    """
+
+    if database_path not in _engines:
+        engine = create_engine(f'sqlite:///{database_path}')
+
+        @event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, _) -> None:
+            # Disable the implicit transactions of pysqlite, see `begin`
+            dbapi_connection.isolation_level = None
+
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            cursor.close()
+
+        @event.listens_for(engine, 'begin')
+        def begin(connection) -> None:
+            connection.exec_driver_sql('BEGIN')
+
+        _engines[database_path] = engine
+
+    return _engines[database_path]
+
+
+def dispose_engine(database_path: str) -> None:
+    """
+    Close the pooled connections of a database and forget its engine, e.g. before the file is moved.
+
+    :param database_path: path to the SQLite database file.
+    :return: none
+    """
+
+    engine = _engines.pop(database_path, None)
+    if engine is not None:
+        engine.dispose()
+
+
+def begin(engine) -> object:
+    """
+    Open a transaction on an engine, or join the transaction of a connection.
+
+    :param engine: the engine returned by `get_engine`, or a connection in an open transaction.
+    :return: a context manager giving the connection to use.
+    """
+
+    return nullcontext(engine) if isinstance(engine, Connection) else engine.begin()
+
+
+def write_tables(engine: Engine, tables: dict, indexes: dict = None, chunksize: int = 50000) -> None:
+    """
+    Bulk write several DataFrames to SQLite tables in a single transaction.
+
+    Each table is created empty from the DataFrame dtypes under a staging name, filled with
+    `executemany` batches of `chunksize` rows, then swapped with the previous table and indexed.
+    Since everything is committed at once, readers never see a half-written or missing table.
+    :param engine: the engine returned by `get_engine`, or a connection to write in its open transaction.
+    :param tables: mapping of table names to DataFrames.
+    :param indexes: optional mapping of table names to the columns to index.
+    :param chunksize: the number of rows sent to the database per batch.
+    :return: none
+    """
+
+    indexes = indexes or {}
+
+    with begin(engine) as connection:
+        for table, df in tables.items():
+            staging = f'{table}__staging'
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{staging}"')
+
+            # Let pandas map the dtypes to column types, then insert the rows directly
+            df.head(0).to_sql(staging, con=connection, index=False)
+
+            columns = ', '.join(f'"{column}"' for column in df.columns)
+            placeholders = ', '.join('?' for _ in df.columns)
+            insert = f'INSERT INTO "{staging}" ({columns}) VALUES ({placeholders})'
+
+            for start in range(0, len(df), chunksize):
+                rows = list(df.iloc[start:start + chunksize].itertuples(index=False, name=None))
+                connection.exec_driver_sql(insert, rows)
+
+            connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{table}"')
+            connection.exec_driver_sql(f'ALTER TABLE "{staging}" RENAME TO "{table}"')
+
+            for column in indexes.get(table, []):
+                if column in df.columns:
+                    connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" '
+                                               f'ON "{table}" ("{column}")')
+
+
+def upsert_tables(engine: Engine, tables: dict, keys: dict, indexes: dict = None, chunksize: int = 50000,
+                  version_column: str = 'version', versions_table: str = 'export_versions',
+                  deleted_column: str = 'deleted') -> int:
+    """
+    Write DataFrames to SQLite tables with INSERT ... ON CONFLICT DO UPDATE instead of replacing them.
+
+    Each call registers a new export version. Only the rows that are new or whose values changed
+    are written, and they are stamped with that version, so consumers can fetch the rows changed
+    since a given version. Rows whose key is no longer exported are kept as tombstones: their
+    `deleted_column` is set to 1 and they are stamped with the version, so the deletions are seen
+    as changes too. A table without a unique index on its key (e.g. written by `write_tables`) or
+    with other columns is recreated. Everything is committed in a single transaction.
+    :param engine: the engine returned by `get_engine`, or a connection to write in its open transaction.
+    :param tables: mapping of table names to DataFrames.
+    :param keys: mapping of table names to their key column, or list of columns for a composite key.
+    :param indexes: optional mapping of table names to the columns to index.
+    :param chunksize: the number of rows sent to the database per batch.
+    :param version_column: the column holding the version of the export that last changed each row.
+    :param versions_table: the table listing the export versions.
+    :param deleted_column: the column set to 1 on the rows which are no longer exported.
+    :return: the version of this export.
+    :raises ValueError: if a key is missing or shared by several rows of a table; nothing is written.
+    """
+
+    indexes = indexes or {}
+
+    with begin(engine) as connection:
+        connection.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS "{versions_table}" '
+                                   f'(version INTEGER PRIMARY KEY AUTOINCREMENT, exported_at TEXT NOT NULL)')
+        version = connection.exec_driver_sql(f'INSERT INTO "{versions_table}" (exported_at) '
+                                             f"VALUES (datetime('now'))").lastrowid
+
+        for table, df in tables.items():
+            key = [keys[table]] if isinstance(keys[table], str) else list(keys[table])
+            _check_keys(table, df, key)
+
+            df = df.assign(**{deleted_column: 0})
+            columns = list(df.columns)
+            conflict = ', '.join(f'"{column}"' for column in key)
+
+            if not _has_layout(connection, table, columns + [version_column], key):
+                connection.exec_driver_sql(f'DROP TABLE IF EXISTS "{table}"')
+                df.head(0).assign(**{version_column: 0}).to_sql(table, con=connection, index=False)
+                connection.exec_driver_sql(f'CREATE UNIQUE INDEX "uq_{table}" ON "{table}" ({conflict})')
+
+            # Only update the rows where at least one value, or the deleted flag, differs from the stored one
+            values = [column for column in columns if column not in key]
+            names = ', '.join(f'"{column}"' for column in columns + [version_column])
+            placeholders = ', '.join('?' for _ in columns + [version_column])
+            updates = ', '.join(f'"{column}" = excluded."{column}"' for column in values + [version_column])
+            changed = ' OR '.join(f'"{table}"."{column}" IS NOT excluded."{column}"' for column in values)
+            insert = (f'INSERT INTO "{table}" ({names}) VALUES ({placeholders}) '
+                      f'ON CONFLICT ({conflict}) DO UPDATE SET {updates} WHERE {changed}')
+
+            for start in range(0, len(df), chunksize):
+                chunk = df.iloc[start:start + chunksize]
+                rows = [row + (version,) for row in chunk.itertuples(index=False, name=None)]
+                connection.exec_driver_sql(insert, rows)
+
+            # Turn the rows which are no longer exported into tombstones of this version
+            key_names = [f'key_{i}' for i in range(len(key))]
+            connection.exec_driver_sql('DROP TABLE IF EXISTS temp.exported_keys')
+            connection.exec_driver_sql(f'CREATE TEMP TABLE exported_keys ({", ".join(key_names)}, '
+                                       f'PRIMARY KEY ({", ".join(key_names)}))')
+            connection.exec_driver_sql(f'INSERT INTO temp.exported_keys VALUES ({", ".join("?" for _ in key)})',
+                                       list(df[key].itertuples(index=False, name=None)))
+            exported = ' AND '.join(f'e.{name} = "{table}"."{column}"' for name, column in zip(key_names, key))
+            connection.exec_driver_sql(f'UPDATE "{table}" SET "{deleted_column}" = 1, "{version_column}" = ? '
+                                       f'WHERE "{deleted_column}" = 0 AND NOT EXISTS '
+                                       f'(SELECT 1 FROM temp.exported_keys AS e WHERE {exported})', (version,))
+
+            for column in indexes.get(table, []) + [version_column]:
+                if column not in key:
+                    connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" '
+                                               f'ON "{table}" ("{column}")')
+
+        connection.exec_driver_sql('DROP TABLE IF EXISTS temp.exported_keys')
+
+    return version
+
+
+def _check_keys(table: str, df, key: list) -> None:
+    """
+    Check that every row of a table to upsert has a key, and that no two rows share it.
+
+    :param table: the name of the table.
+    :param df: the rows to upsert.
+    :param key: the key columns.
+    :return: none
+    :raises ValueError: if a key is missing or duplicated.
+    """
+
+    missing = [column for column in key if column not in df.columns]
+    if missing:
+        raise ValueError(f'the key columns {", ".join(missing)} of {table} are not exported')
+
+    if df[key].isna().any(axis=None):
+        raise ValueError(f'{table} has rows without a value for its key ({", ".join(key)})')
+
+    duplicated = df.duplicated(subset=key, keep=False)
+    if duplicated.any():
+        examples = df.loc[duplicated, key].drop_duplicates().head(3).to_dict(orient='records')
+        raise ValueError(f'{table} has {duplicated.sum()} rows sharing their key ({", ".join(key)}), e.g. '
+                         f'{examples}: set a unique key in export_final_results.keys')
+
+
+def _has_layout(connection, table: str, columns: list, key: list) -> bool:
+    """
+    Check that a table exists with exactly the given columns and a unique index on its key.
+
+    :param connection: an open SQLAlchemy connection.
+    :param table: the name of the table.
+    :param columns: the expected columns.
+    :param key: the key columns.
+    :return: True if the table can be upserted as is.
+    """
+
+    existing = [row[1] for row in connection.exec_driver_sql(f'PRAGMA table_info("{table}")')]
+    if sorted(existing) != sorted(columns):
+        return False
+
+    for index in connection.exec_driver_sql(f'PRAGMA index_list("{table}")').fetchall():
+        # index_list rows: (seq, name, unique, origin, partial)
+        if index[2]:
+            indexed = [row[2] for row in connection.exec_driver_sql(f'PRAGMA index_info("{index[1]}")')]
+            if indexed == key:
+                return True
+
+    return False
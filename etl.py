@@ -1,19 +1,24 @@
+import io
 import os
+import glob
+import sqlite3
+import hashlib
+import logging
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 
-from constants import config_file, input_dir, financial_indicators_path, largest_companies_path
-from helpers import get_serialized_data
-
-
-def get_config() -> dict:
-    """
-    Load and return the project configuration dictionary from the serialized config file path.
-    :return: the serialized data
-    """
-
-    # Build the full path to the config file and load the data
-    config_full_path = os.path.join(os.getcwd(), config_file)
-    return get_serialized_data(config_full_path)
+from constants import config_file
+from helpers import (get_files_hash, read_csv_with_schema, get_partial_means,
+                     combine_partial_means, finalize_partial_means, get_output_path, write_frame, read_frame,
+                     FrameWriter, concat_frames, get_schema, get_partition_path, get_float32_columns,
+                     restore_float64)
+from logger import Logger
+from configuration import get_config
+from manifest import EtlManifest, RowHashIndex
+from sql_engine import (is_duckdb_available, connect_duckdb, get_duckdb_source, stage_frames, get_clean_query,
+                        get_merge_query, iter_query, cast_to_schema, quote_identifier)
+from instrumentation import instrumented, configure as configure_instrumentation
 
 
 class Etl:
@@ -33,8 +38,16 @@ class Etl:
         self.config = config
         self.input_dir = input_dir
 
+        # Input files, located in the input folder
+        input_files = self.config['input_files_csv']
+        self.financial_indicators_path = os.path.join(self.input_dir, input_files['source_financial_indicators'])
+        self.largest_companies_path = os.path.join(self.input_dir, input_files['source_largest_companies'])
+
         self.largest_comp_col = self.config['largest_companies']
         self.merged_dataset = self.config['merged_dataset']['columns']
+        self.schema = get_schema(self.config)
+        self.output_format = self.config['output_files_csv']['format']
+        self.compact = self.config['etl']['compact']
 
         # Initialize dataframes for each ETL stage
         self.df_financial_indicators_raw = pd.DataFrame()
@@ -44,6 +57,19 @@ class Etl:
         self.df_largest_companies = pd.DataFrame()
         self.df_merged = pd.DataFrame()
 
+        # Companies are averaged per country, and per year in panel mode
+        self.panel = self.config['panel']
+        self.group_keys = [self.largest_comp_col['columns']['headquarters']]
+        self.merge_keys = [self.config['merged_dataset']['merge_on']]
+        if self.panel['enabled']:
+            self.group_keys.append(self.panel['year'])
+            self.merge_keys.append(self.panel['year'])
+
+        # Filled by the chunked extract, which never holds the whole company dataset in memory
+        self.row_hashes = None
+        self.partial_means = None
+
+    @instrumented(rows=lambda etl, _: len(etl.df_largest_companies_raw))
     def extract(self) -> None:
         """
         Extract raw data from CSV sources intro pandas DataFrames.
@@ -52,12 +78,45 @@ class Etl:
 
         # Load the raw CSV files for financial indicators and company data
         try:
-            self.df_financial_indicators_raw = pd.read_csv(financial_indicators_path, sep=',')
-            self.df_largest_companies_raw = pd.read_csv(largest_companies_path, sep=',')
+            self.df_financial_indicators_raw = self.read_input(self.financial_indicators_path,
+                                                               'financial_indicators')
+            self.df_largest_companies_raw = self.read_input(self.largest_companies_path, 'largest_companies')
         except FileNotFoundError as e:
             print(f'[Error] File not found : {e}')
 
 
+    def read_input(self, path, name: str, **kwargs) -> pd.DataFrame:
+        """
+        Read an input CSV file with the dtypes declared for it in the configuration schema.
+
+        :param path: the CSV file path or buffer.
+        :param name: the name of the input in the schema section of the configuration.
+        :param kwargs: other arguments passed to `pd.read_csv`.
+        :return: the raw dataframe, or an iterator of dataframes when `chunksize` is given.
+        """
+
+        return read_csv_with_schema(path, self.schema[name], engine=self.schema['csv_engine'], **kwargs)
+
+    def get_shard_paths(self) -> list:
+        """
+        List the company files matching `input_files_csv.largest_companies_shards` in the input folder.
+        :return: the sorted shard paths, empty when no shard pattern is configured.
+        """
+
+        pattern = self.config['input_files_csv']['largest_companies_shards']
+        if not pattern:
+            return []
+
+        return sorted(glob.glob(os.path.join(self.input_dir, pattern)))
+
+    def get_input_paths(self) -> list:
+        """
+        List the input files read by the ETL.
+        :return: the financial indicators path followed by the company file or shards.
+        """
+
+        return [self.financial_indicators_path] + (self.get_shard_paths() or [self.largest_companies_path])
+
     def transform(self) -> None:
         """
         Apply a series of transformation steps: cleaning, aggregation, merging,
@@ -66,10 +125,26 @@ class Etl:
         """
 
         self.clean_data()
+        self.release_frames('df_financial_indicators_raw', 'df_largest_companies_raw')
         self.aggregate_data()
         self.merge_data()
+        self.release_frames('df_financial_indicators', 'df_largest_companies_aggregated')
         self.sort_countries_by_total_assets()
 
+    def release_frames(self, *names: str) -> None:
+        """
+        Replace dataframes no longer needed by empty ones, so their memory can be freed,
+        when `etl.compact.release_frames` is enabled.
+
+        :param names: the names of the dataframe attributes.
+        :return: none
+        """
+
+        if self.compact['release_frames']:
+            for name in names:
+                setattr(self, name, pd.DataFrame())
+
+    @instrumented(rows=lambda etl, _: len(etl.df_largest_companies))
     def clean_data(self) -> None:
         """
         Clean the raw datasets by replacing 0s with NaN, dropping empty and duplicate rows,
@@ -83,31 +158,65 @@ class Etl:
 
         self.largest_comp_col = self.config['largest_companies']
 
-        print(f'before the renaming: {self.df_largest_companies.columns}')
-        print(f'before the renaming: {self.df_financial_indicators.columns}')
+        logging.debug('before the renaming: %s', self.df_largest_companies.columns)
+        logging.debug('before the renaming: %s', self.df_financial_indicators.columns)
 
 
         # Apply cleaning to both datasets
         for df in [self.df_financial_indicators, self.df_largest_companies]:
-            df.replace(0, pd.NA, inplace=True)
-            df.dropna(how='all', inplace=True)
-            df.drop_duplicates(inplace=True)
-            df.columns=(df.columns
-                        .str.replace(r' \(% of GDP\)', '', regex=True)
-                        .str.replace(r' in \(USD Million\)', ' usd millions', regex=True)
-                        .str.replace(r' in \(USD Millions\)', ' usd millions', regex=True)
-                        .str.replace(r' \(%\)', ' ', regex=True)
-                        .str.replace(r' \(USD Trillions\)', ' usd trillions', regex=True)
-                        .str.strip()
-                        .str.replace(' ', '_')
-                        .str.lower())
-            df.rename(columns={'total_assest_usd_millions':'total_asset_usd_millions'}, inplace=True)  # pour que ca soit correct dans yaml
+            self.clean_frame(df)
 
         self.df_largest_companies.rename(columns=self.largest_comp_col['columns'], inplace=True)
 
-        print(f'after the renaming: {self.df_largest_companies.columns}')
-        print(f'after the renaming: {self.df_financial_indicators.columns}')
+        logging.debug('after the renaming: %s', self.df_largest_companies.columns)
+        logging.debug('after the renaming: %s', self.df_financial_indicators.columns)
+
+        # Halve the monetary columns when their values at the input precision are kept by float32
+        float32_columns = get_float32_columns(self.df_largest_companies, self.compact['float32_columns'],
+                                              self.compact['decimals'])
+        if float32_columns:
+            self.df_largest_companies = self.df_largest_companies.astype(dict.fromkeys(float32_columns, 'float32'))
+            logging.debug('stored as float32: %s', float32_columns)
 
+    @staticmethod
+    def clean_frame(df: pd.DataFrame) -> None:
+        """
+        Clean a raw dataset in place: replace 0s with NaN, drop empty and duplicate rows
+        and normalize the column names.
+
+        Zeros are masked column-wise on the numeric columns only, so they keep a numeric dtype
+        instead of being upcast to object by `pd.NA`.
+        :param df: the raw dataframe to clean.
+        :return: none
+        """
+
+        numeric_columns = df.select_dtypes('number').columns
+        df[numeric_columns] = df[numeric_columns].mask(df[numeric_columns] == 0)
+        df.dropna(how='all', inplace=True)
+        df.drop_duplicates(inplace=True)
+        df.columns = Etl.get_clean_column_names(df.columns)
+
+    @staticmethod
+    def get_clean_column_names(columns: pd.Index) -> pd.Index:
+        """
+        Normalize raw column names, e.g. 'Revenue in (USD Million)' becomes 'revenue_usd_millions'.
+
+        :param columns: the raw column names.
+        :return: the normalized column names.
+        """
+
+        columns=(pd.Index(columns)
+                 .str.replace(r' \(% of GDP\)', '', regex=True)
+                 .str.replace(r' in \(USD Million\)', ' usd millions', regex=True)
+                 .str.replace(r' in \(USD Millions\)', ' usd millions', regex=True)
+                 .str.replace(r' \(%\)', ' ', regex=True)
+                 .str.replace(r' \(USD Trillions\)', ' usd trillions', regex=True)
+                 .str.strip()
+                 .str.replace(' ', '_')
+                 .str.lower())
+        return columns.str.replace('total_assest_usd_millions', 'total_asset_usd_millions')  # pour que ca soit correct dans yaml
+
+    @instrumented(rows=lambda etl, _: len(etl.df_largest_companies_aggregated))
     def aggregate_data(self) -> None:
         """
         Group the company data by country, compute the mean of numeric values,
@@ -117,43 +226,56 @@ class Etl:
 
         df = self.df_largest_companies.copy()
 
-        print(f'before aggregation: {df.columns}')
+        logging.debug('before aggregation: %s', df.columns)
 
         # Drop the columns not needed for aggregation
         df.drop(self.largest_comp_col['drop_columns_largest_companies'], axis=1, inplace=True)
 
-        # Group by country and compute the mean for numeric columns
-        df_mean=(df.groupby(self.largest_comp_col['columns']['headquarters'], as_index=False)
+        # Average the original float64 values of the float32 columns
+        df = self.get_float64_frame(df)
+
+        # Group by country (and year) and compute the mean for numeric columns
+        df_mean=(df.groupby(self.group_keys, as_index=False, observed=True)
                                             .mean(numeric_only=True))
 
-        print(f'before the renaming of df_mean: {df_mean.columns}')
+        logging.debug('before the renaming of df_mean: %s', df_mean.columns)
 
         # Rename the resulting aggregated columns
         df_mean.rename(columns=self.largest_comp_col['aggregated'],
                        inplace=True)
 
-        print(f'after the renaming of df_mean: {df_mean.columns}')
+        logging.debug('after the renaming of df_mean: %s', df_mean.columns)
 
         self.df_largest_companies_aggregated = df_mean
 
-        print(f'after aggregation: {self.df_largest_companies_aggregated.columns}')
+        logging.debug('after aggregation: %s', self.df_largest_companies_aggregated.columns)
+
+    def get_float64_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Give the company columns stored as float32 by `clean_data` their original float64 values back.
+
+        :param df: the cleaned company dataframe.
+        :return: the dataframe with float64 monetary columns.
+        """
+
+        return restore_float64(df, self.compact['float32_columns'], self.compact['decimals'])
 
+    @instrumented(rows=lambda etl, _: len(etl.df_merged))
     def merge_data(self) -> None:
         """
-        Merge aggregated company data with financial indicators on the 'Country' column.
+        Merge aggregated company data with financial indicators on the 'Country' column,
+        and on the year in panel mode.
         Column names are renamed according to config after merging.
         :return: none
         """
 
-        merge_col = self.config['merged_dataset']['merge_on']
-
         self.df_merged = pd.merge(
             self.df_largest_companies_aggregated,
             self.df_financial_indicators,
             how='inner',
-            on=merge_col)
+            on=self.merge_keys)
 
-        print(f'new names merged table: {self.df_merged.columns}')
+        logging.debug('new names merged table: %s', self.df_merged.columns)
 
         # Rename merged columns based on config
         self.df_merged.rename(columns=self.config['merged_dataset']['columns'],
@@ -162,68 +284,613 @@ class Etl:
         self.df_merged = self.df_merged.round(3)
 
 
+    @instrumented(rows=lambda etl, _: len(etl.df_merged))
     def sort_countries_by_total_assets(self) -> pd.DataFrame:
         """
-        Sort the merged dataset in descending order based on mean total assets.
+        Sort the merged dataset in descending order based on mean total assets,
+        year by year in panel mode.
         :return: the sorted dataframe by mean total assets
         """
 
         mean_total_asset = self.merged_dataset['mean_total_asset']
 
-        self.df_merged.sort_values(
-            by=mean_total_asset,
-            ascending=False,
-            inplace=True)
+        if self.panel['enabled']:
+            self.df_merged.sort_values(by=[self.panel['year'], mean_total_asset], ascending=[True, False],
+                                       inplace=True, kind='stable')
+        else:
+            # Stable, so countries with equal or missing means stay in country order whatever the engine
+            self.df_merged.sort_values(
+                by=mean_total_asset,
+                ascending=False,
+                inplace=True,
+                kind='stable')
 
         self.df_merged[mean_total_asset] = self.df_merged[mean_total_asset].round(2)
 
         return self.df_merged
 
 
+    def get_output_path(self, name: str) -> str:
+        """
+        Build the path of an output file in the configured output folder and format.
+
+        :param name: the key of the file in the output_files_csv section of the configuration.
+        :return: the full path of the output file.
+        """
+
+        return get_output_path(self.config['folders']['output_folder'], self.config['output_files_csv'][name],
+                               self.output_format)
+
+    @instrumented(rows=lambda etl, _: len(etl.df_largest_companies))
     def load(self) -> None:
         """
-        Export the transformed datasets CSV.
+        Export the transformed datasets in the configured format (CSV, Parquet or Feather).
         :return: none
         """
 
+        # The company file holds the original values, whatever the dtypes kept in memory
         export = {
-            self.config['output_files_csv']['merged_table']: self.df_merged,
-            self.config['output_files_csv']['largest_companies']: self.df_largest_companies
+            'merged_table': self.df_merged,
+            'largest_companies': self.get_float64_frame(self.df_largest_companies)
         }
 
         try:
             output_folder = self.config['folders']['output_folder']
             os.makedirs(output_folder, exist_ok=True)
 
-            # Save each DataFrame to CSV in the output directory
+            # Save each DataFrame in the output directory
             for name, df in export.items():
-                csv_path = os.path.join(output_folder, f'{name}')
-                df.to_csv(csv_path, index=False)
+                write_frame(df, self.get_output_path(name), self.output_format)
         except PermissionError as e:
             print(f'[Error] Datasets not exported: {e}')
 
 
-    def sanity_check(self):
-        print("**** sanity check ****")
-        print(f"df_merged={self.df_merged.shape}")
-        print(f"df_largest_companies={self.df_largest_companies.shape}")
-        print(f"df_merged={self.df_merged.describe()}")
-        print(f"df_largest_companies={self.df_largest_companies.describe()}")
+    def sanity_check(self, sample_size: int = None) -> bool:
+        """
+        Validate the transformed datasets and log a short report.
 
+        Checks are run on a random sample of at most `sample_size` rows per dataset (the whole
+        dataset when None); the `describe()` statistics are only computed when DEBUG logging is on.
+        :param sample_size: the maximum number of rows checked per dataset.
+        :return: True if no problem was found.
+        """
 
-    def run(self) -> None:
-        self.extract()
-        self.transform()
+        logging.info('sanity check: df_merged=%s, df_largest_companies=%s',
+                     self.df_merged.shape, self.df_largest_companies.shape)
+
+        valid = True
+        country = self.merged_dataset['country']
+
+        if self.df_merged.duplicated(subset=[country] + self.merge_keys[1:]).any():
+            logging.warning('sanity check: duplicated countries in df_merged')
+            valid = False
+
+        for name, df in {'df_merged': self.df_merged, 'df_largest_companies': self.df_largest_companies}.items():
+            if sample_size is not None and len(df) > sample_size:
+                df = df.sample(n=sample_size, random_state=0)
+
+            if np.isinf(df.select_dtypes('number').to_numpy(dtype='float64')).any():
+                logging.warning('sanity check: infinite values in %s', name)
+                valid = False
+
+            if not df.empty and logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug('%s=%s', name, df.describe())
+
+        return valid
+
+
+    @instrumented(rows=lambda etl, _: len(etl.row_hashes) if etl.row_hashes is not None else None)
+    def run_chunked(self) -> None:
+        """
+        Run the ETL while streaming the company file by chunks of `etl.chunksize` rows.
+
+        Each chunk is cleaned, renamed, deduplicated against the rows already seen and reduced to
+        per-country running sums and counts, then appended to the exported company file. Peak memory
+        is bounded by the chunk size instead of the file size, except for deduplication: the hashes
+        of the rows already seen take 8 bytes per distinct row, so that memory grows with the
+        number of distinct rows of the file. `df_largest_companies` is left empty.
+        :return: none
+        """
+
+        chunksize = self.config['etl']['chunksize']
+        output_folder = self.config['folders']['output_folder']
+        largest_path = self.get_output_path('largest_companies')
+        tmp_path = f'{largest_path}.tmp'
+
+        self.df_financial_indicators_raw = self.read_input(self.financial_indicators_path, 'financial_indicators')
+        self.df_financial_indicators = self.df_financial_indicators_raw.copy()
+        self.clean_frame(self.df_financial_indicators)
+
+        seen = RowHashIndex()
+        partial_means = []
+
+        try:
+            os.makedirs(output_folder, exist_ok=True)
+            writer = FrameWriter(tmp_path, self.output_format)
+
+            for chunk in self.read_input(self.largest_companies_path, 'largest_companies', chunksize=chunksize):
+                self.clean_frame(chunk)
+                chunk.rename(columns=self.largest_comp_col['columns'], inplace=True)
+
+                # Drop the rows already seen in a previous chunk
+                hashes = self.get_row_hashes(chunk)
+                known = seen.contains(hashes)
+                chunk = chunk[~known]
+                seen.add(hashes[~known])
+
+                # Only the per-country partial results are kept, combined as we go
+                partial_means = [combine_partial_means(partial_means + [self.get_partial_aggregates(chunk)])]
+
+                writer.write(chunk)
+
+            writer.close()
+
+            # Readers never see a partially written file
+            os.replace(tmp_path, largest_path)
+        except PermissionError as e:
+            print(f'[Error] Datasets not exported: {e}')
+            return
+
+        self.row_hashes = seen
+        self.partial_means = partial_means[0]
+
+        self.df_largest_companies_aggregated = (finalize_partial_means(self.partial_means)
+                                                .rename(columns=self.largest_comp_col['aggregated']))
+        self.merge_data()
+        self.sort_countries_by_total_assets()
+
+        try:
+            write_frame(self.df_merged, self.get_output_path('merged_table'), self.output_format)
+        except PermissionError as e:
+            print(f'[Error] Datasets not exported: {e}')
+
+    @instrumented(rows=lambda etl, _: len(etl.df_largest_companies))
+    def run_sharded(self) -> None:
+        """
+        Run the ETL on company files sharded in the input folder, e.g. one file per region or year.
+
+        The shards are read, cleaned and reduced to per-country sums and counts concurrently by a
+        pool of `etl.workers` processes while the financial indicators are read. The cleaned shards
+        are concatenated and their partial sums and counts combined; when a row appears in several
+        shards, the means are recomputed from the deduplicated rows instead.
+        :return: none
+        """
+
+        shard_paths = self.get_shard_paths()
+        if not shard_paths:
+            print(f'[Error] File not found : no file matching '
+                  f'{self.config["input_files_csv"]["largest_companies_shards"]} in {self.input_dir}')
+            return
+
+        workers = min(self.config['etl']['workers'] or os.cpu_count(), len(shard_paths))
+
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(extract_shard, self.config, path) for path in shard_paths]
+
+                self.df_financial_indicators_raw = self.read_input(self.financial_indicators_path,
+                                                                   'financial_indicators')
+                shards = [future.result() for future in futures]
+        except FileNotFoundError as e:
+            print(f'[Error] File not found : {e}')
+            return
+
+        self.df_financial_indicators = self.df_financial_indicators_raw.copy()
+        self.clean_frame(self.df_financial_indicators)
+
+        self.df_largest_companies = concat_frames([df for df, _ in shards])
+        n_rows = len(self.df_largest_companies)
+        self.df_largest_companies.drop_duplicates(inplace=True)
+
+        if len(self.df_largest_companies) == n_rows:
+            self.partial_means = combine_partial_means([partial for _, partial in shards])
+            self.df_largest_companies_aggregated = (finalize_partial_means(self.partial_means)
+                                                    .rename(columns=self.largest_comp_col['aggregated']))
+        else:
+            logging.info(f'sharded ETL: {n_rows - len(self.df_largest_companies)} rows duplicated across shards')
+            self.aggregate_data()
+
+        self.merge_data()
+        self.sort_countries_by_total_assets()
         self.load()
 
+    @instrumented(rows=lambda etl, _: len(etl.df_merged))
+    def run_sql(self) -> None:
+        """
+        Run the clean, aggregate and merge steps as SQL queries instead of pandas, so that company
+        files larger than the memory can be processed.
+
+        With the `duckdb` engine the CSV files are queried directly by DuckDB, which spills to the
+        output folder when needed. With `sqlite` (also used when DuckDB is not installed) they are
+        first loaded by chunks of `etl.staging_chunksize` rows into a staging database in the output
+        folder, deleted after the run. The clean company rows are streamed to the output file and
+        `df_largest_companies` is left empty; only the merged table is held in memory.
+        :return: none
+        """
+
+        engine = self.config['etl']['engine']
+        chunksize = self.config['etl']['staging_chunksize']
+        output_folder = self.config['folders']['output_folder']
+        staging_path = os.path.join(output_folder, self.config['etl']['staging_database'])
+        largest_path = self.get_output_path('largest_companies')
+        tmp_path = f'{largest_path}.tmp'
+
+        if engine == 'duckdb' and not is_duckdb_available():
+            logging.warning('duckdb is not installed, the sqlite engine is used instead')
+            engine = 'sqlite'
+
+        inputs = {'financial_indicators': self.financial_indicators_path,
+                  'largest_companies': self.largest_companies_path}
+
+        os.makedirs(output_folder, exist_ok=True)
+
+        try:
+            if engine == 'duckdb':
+                connection = connect_duckdb(output_folder)
+                sources = {name: get_duckdb_source(path, self.schema[name]) for name, path in inputs.items()}
+            else:
+                connection = sqlite3.connect(staging_path)
+                connection.execute('PRAGMA journal_mode=OFF')
+                connection.execute('PRAGMA synchronous=OFF')
+                sources = {name: stage_frames(connection, f'{name}_raw',
+                                              self.read_input(path, name, chunksize=chunksize))
+                           for name, path in inputs.items()}
+        except FileNotFoundError as e:
+            print(f'[Error] File not found : {e}')
+            return
+
+        try:
+            # Clean both inputs into tables, with the column names of the pandas steps
+            columns = {}
+            for name, source in sources.items():
+                raw_columns = list(self.schema[name])
+                clean_columns = self.get_clean_column_names(raw_columns)
+                if name == 'largest_companies':
+                    renames = self.largest_comp_col['columns']
+                    clean_columns = clean_columns.map(lambda column: renames.get(column, column))
+
+                columns[name] = dict(zip(raw_columns, clean_columns))
+                numeric_columns = [column for column, dtype in self.schema[name].items()
+                                   if pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype))]
+
+                connection.execute(f'DROP TABLE IF EXISTS {quote_identifier(name)}')
+                connection.execute(f'CREATE TABLE {quote_identifier(name)} AS '
+                                   f'{get_clean_query(source, columns[name], numeric_columns)}')
+
+            country = self.config['merged_dataset']['merge_on']
+            dropped = self.largest_comp_col['drop_columns_largest_companies']
+            company_columns = list(columns['largest_companies'].values())
+            company_dtypes = zip(company_columns, self.schema['largest_companies'].values())
+            mean_columns = [column for column, dtype in company_dtypes
+                            if column not in [country, dropped]
+                            and pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype))]
+            indicator_columns = [column for column in columns['financial_indicators'].values() if column != country]
+
+            query = get_merge_query(quote_identifier('largest_companies'), quote_identifier('financial_indicators'),
+                                    country, mean_columns, indicator_columns)
+            # A chunk of countries without any value would otherwise hold object columns
+            numeric_columns = dict.fromkeys(mean_columns + indicator_columns, 'float64')
+            self.df_merged = (pd.concat([chunk.astype(numeric_columns)
+                                         for chunk in iter_query(connection, query, chunksize)], ignore_index=True)
+                              .rename(columns=self.largest_comp_col['aggregated'])
+                              .rename(columns=self.config['merged_dataset']['columns'])
+                              .round(3))
+            self.sort_countries_by_total_assets()
+
+            # Stream the clean company rows to the output file, in file order
+            selected = ', '.join(quote_identifier(column) for column in company_columns)
+            writer = FrameWriter(tmp_path, self.output_format)
+            for chunk in iter_query(connection, f'SELECT {selected} FROM {quote_identifier("largest_companies")} '
+                                                f'ORDER BY row_order', chunksize):
+                writer.write(cast_to_schema(chunk, self.schema['largest_companies_output']))
+            writer.close()
+
+            os.replace(tmp_path, largest_path)
+            write_frame(self.df_merged, self.get_output_path('merged_table'), self.output_format)
+        except PermissionError as e:
+            print(f'[Error] Datasets not exported: {e}')
+        finally:
+            connection.close()
+            if engine == 'sqlite' and os.path.exists(staging_path):
+                os.remove(staging_path)
+
+    @instrumented(rows=lambda etl, _: len(etl.df_merged))
+    def run_panel(self) -> None:
+        """
+        Run the ETL on yearly panels, where both inputs have a year column.
+
+        Companies are averaged per country and year and merged with the financial indicators of the
+        same year. Each output is partitioned by year, in a folder named after the output file, and
+        only the years whose input rows changed since the previous run (according to the hashes kept
+        in `panel.manifest_file`) are recomputed and rewritten; `df_merged` and `df_largest_companies`
+        only hold these years.
+        :return: none
+        """
+
+        year = self.panel['year']
+        output_folder = self.config['folders']['output_folder']
+
+        self.extract()
+        self.clean_data()
+
+        manifest = EtlManifest(os.path.join(output_folder, self.panel['manifest_file']))
+        config_hash = get_files_hash([config_file])
+        year_hashes = self.get_year_hashes()
+
+        # A new configuration may change every year
+        if not manifest.load() or manifest.config_hash != config_hash:
+            manifest.year_hashes = {}
+
+        changed_years = [value for value, digest in year_hashes.items()
+                         if manifest.year_hashes.get(value) != digest
+                         or not all(os.path.exists(self.get_partition_path(name, value))
+                                    for name in ('merged_table', 'largest_companies'))]
+        removed_years = [value for value in manifest.year_hashes if value not in year_hashes]
+
+        logging.info(f'panel ETL: years {changed_years} recomputed, years {removed_years} removed')
+
+        self.df_largest_companies = self.df_largest_companies[self.df_largest_companies[year].isin(changed_years)]
+        self.df_financial_indicators = self.df_financial_indicators[
+            self.df_financial_indicators[year].isin(changed_years)]
+
+        self.aggregate_data()
+        self.merge_data()
+        self.sort_countries_by_total_assets()
+
+        export = {
+            'merged_table': self.df_merged,
+            'largest_companies': self.get_float64_frame(self.df_largest_companies)
+        }
+
+        try:
+            for name, df in export.items():
+                for value in removed_years:
+                    if os.path.exists(self.get_partition_path(name, value)):
+                        os.remove(self.get_partition_path(name, value))
+
+                # A changed year without rows left is written as an empty partition
+                partitions = dict(list(df.groupby(year, observed=True)))
+                for value in changed_years:
+                    path = self.get_partition_path(name, value)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    write_frame(partitions.get(value, df.head(0)), path, self.output_format)
+        except PermissionError as e:
+            print(f'[Error] Datasets not exported: {e}')
+            return
+
+        manifest.config_hash = config_hash
+        manifest.year_hashes = year_hashes
+        manifest.save()
+
+    def get_year_hashes(self) -> dict:
+        """
+        Hash the clean input rows of each year, companies and financial indicators together.
+        :return: mapping of each year to the hexadecimal digest of its rows.
+        """
+
+        year = self.panel['year']
+        digests = {}
+
+        for df in (self.df_financial_indicators, self.get_float64_frame(self.df_largest_companies)):
+            hashes = pd.util.hash_pandas_object(df, index=False)
+            for value, group in hashes.groupby(df[year].to_numpy()):
+                digests.setdefault(int(value), hashlib.sha256()).update(group.to_numpy().tobytes())
+
+        return {value: digest.hexdigest() for value, digest in sorted(digests.items())}
+
+    def get_partition_path(self, name: str, year: int) -> str:
+        """
+        Build the path of the partition of a year of an output file, in panel mode.
+
+        :param name: the key of the file in the output_files_csv section of the configuration.
+        :param year: the year of the partition.
+        :return: the full path of the partition file.
+        """
+
+        return get_partition_path(self.config['folders']['output_folder'], self.config['output_files_csv'][name],
+                                  self.output_format, self.panel['year'], year)
+
+    def get_row_hashes(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Hash each cleaned company row, independently of the dtypes inferred by the CSV reader.
+
+        :param df: the cleaned company dataframe.
+        :return: an array with one uint64 hash per row.
+        """
+
+        text_columns = [self.largest_comp_col['columns'][key] for key in ('company', 'industry', 'headquarters')]
+
+        normalized = self.get_float64_frame(df).apply(lambda col: col if col.name in text_columns
+                              else pd.to_numeric(col, errors='coerce').astype('float64'))
+
+        return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+    def get_partial_aggregates(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Compute the per-country running sums and counts behind the means of `aggregate_data`.
+
+        :param df: the cleaned company dataframe.
+        :return: the partial sums and counts indexed by country.
+        """
+
+        # Summed in float64, as the means of `aggregate_data`
+        df = self.get_float64_frame(df.drop(self.largest_comp_col['drop_columns_largest_companies'], axis=1))
+
+        return get_partial_means(df, by=self.largest_comp_col['columns']['headquarters'])
+
+    @instrumented(rows=lambda etl, _: len(etl.df_largest_companies))
+    def run_incremental(self) -> None:
+        """
+        Run the ETL only on the rows appended to the company file since the previous run.
+
+        The manifest keeps the hashes of the rows already processed and the per-country sums and
+        counts, so only the countries of the new rows are recomputed in the merged table and the new
+        rows are appended to the exported company file. Any other change (edited or removed rows,
+        found by hashing the part of the company file already processed, new financial indicators
+        or configuration, missing outputs) falls back to a full run which rebuilds the manifest.
+        :return: none
+        """
+
+        output_folder = self.config['folders']['output_folder']
+        merged_path = self.get_output_path('merged_table')
+        largest_path = self.get_output_path('largest_companies')
+
+        manifest = EtlManifest(os.path.join(output_folder, self.config['etl']['manifest_file']))
+        config_hash = get_files_hash([config_file])
+        indicators_hash = get_files_hash([self.financial_indicators_path])
+
+        if (not manifest.load()
+                or manifest.config_hash != config_hash
+                or manifest.financial_indicators_hash != indicators_hash
+                or not (os.path.exists(merged_path) and os.path.exists(largest_path))
+                or not manifest.is_appended(self.largest_companies_path)):
+            logging.info('incremental ETL: full rebuild')
+
+            # Record the file position first so rows appended during the run are picked up next time
+            manifest.record_companies_file(self.largest_companies_path)
+
+            if self.config['etl']['chunksize']:
+                self.run_chunked()
+                manifest.row_hashes = self.row_hashes
+                manifest.partial_means = self.partial_means
+            else:
+                self.extract()
+                self.transform()
+                self.load()
+                manifest.row_hashes = RowHashIndex(self.get_row_hashes(self.df_largest_companies))
+                manifest.partial_means = self.get_partial_aggregates(self.df_largest_companies)
+
+            manifest.config_hash = config_hash
+            manifest.financial_indicators_hash = indicators_hash
+            manifest.save()
+            return
+
+        self.df_financial_indicators_raw = self.read_input(self.financial_indicators_path, 'financial_indicators')
+        appended_rows = manifest.read_appended_rows(self.largest_companies_path)
+        self.df_largest_companies_raw = self.read_input(io.BytesIO(appended_rows), 'largest_companies')
+        self.clean_data()
+
+        # Skip the rows identical to an already processed one, as drop_duplicates does in a full run
+        hashes = self.get_row_hashes(self.df_largest_companies)
+        known = manifest.row_hashes.contains(hashes)
+        self.df_largest_companies = self.df_largest_companies[~known]
+
+        logging.info(f'incremental ETL: {len(self.df_largest_companies)} new rows')
+
+        if not self.df_largest_companies.empty:
+            partial = self.get_partial_aggregates(self.df_largest_companies)
+            manifest.partial_means = combine_partial_means([manifest.partial_means, partial])
+            manifest.row_hashes.add(hashes[~known])
+
+            # Recompute the means of the affected countries only
+            self.df_largest_companies_aggregated = (
+                finalize_partial_means(manifest.partial_means.loc[partial.index])
+                .rename(columns=self.largest_comp_col['aggregated']))
+            self.merge_data()
+
+            country = self.merged_dataset['country']
+            df_previous = read_frame(merged_path, self.output_format, self.schema['merged_table'])
+            df_previous = df_previous[~df_previous[country].isin(self.df_merged[country])]
+            self.df_merged = pd.concat([df_previous, self.df_merged], ignore_index=True)
+            self.sort_countries_by_total_assets()
+
+            try:
+                write_frame(self.df_merged, merged_path, self.output_format)
+
+                df_appended = self.get_float64_frame(self.df_largest_companies)
+                if self.output_format == 'csv':
+                    df_appended.to_csv(largest_path, mode='a', header=False, index=False)
+                else:
+                    # Parquet and Feather files cannot be appended to, the company file is rewritten
+                    df_companies = read_frame(largest_path, self.output_format,
+                                              self.schema['largest_companies_output'])
+                    write_frame(pd.concat([df_companies, df_appended], ignore_index=True),
+                                largest_path, self.output_format)
+            except PermissionError as e:
+                print(f'[Error] Datasets not exported: {e}')
+                return
+
+        manifest.save()
+
+    def get_run_mode(self) -> str:
+        """
+        Select how `run` processes the inputs, from the configuration.
+
+        In panel mode, only the years that changed are recomputed; otherwise, when `etl.engine` is
+        sqlite or duckdb, the steps run as SQL queries; when `input_files_csv.largest_companies_shards`
+        is set, the company shards are processed in parallel (the SQL engines, incremental and chunked
+        modes only apply to a single company file); when `etl.chunksize` is set, the company file is
+        streamed by chunks.
+        :return: one of 'panel', 'sql', 'sharded', 'incremental', 'chunked' or 'full'.
+        """
+
+        if self.panel['enabled']:
+            return 'panel'
+        if self.config['etl']['engine'] != 'pandas':
+            return 'sql'
+        if self.config['input_files_csv']['largest_companies_shards']:
+            return 'sharded'
+        if self.config['etl']['incremental']:
+            return 'incremental'
+        if self.config['etl']['chunksize']:
+            return 'chunked'
+        return 'full'
+
+    def run(self) -> None:
+        """
+        Run the whole ETL in the mode selected by `get_run_mode`. The sanity check runs at the end
+        when `etl.validation` is enabled.
+        :return: none
+        """
+
+        mode = self.get_run_mode()
+
+        if mode == 'panel':
+            self.run_panel()
+        elif mode == 'sql':
+            self.run_sql()
+        elif mode == 'sharded':
+            self.run_sharded()
+        elif mode == 'incremental':
+            self.run_incremental()
+        elif mode == 'chunked':
+            self.run_chunked()
+        else:
+            self.extract()
+            self.transform()
+            self.load()
+
+        validation = self.config['etl']['validation']
+        if validation['enabled']:
+            self.sanity_check(validation['sample_size'])
+
+
+def extract_shard(config: dict, path: str) -> tuple:
+    """
+    Read, clean and pre-aggregate one company shard, in a worker process of `Etl.run_sharded`.
+
+    :param config: dict containing config parameters
+    :param path: the path of the shard.
+    :return: the cleaned and renamed shard, and its per-country partial sums and counts.
+    """
+
+    etl = Etl(config=config, input_dir=os.path.dirname(path))
+
+    df = etl.read_input(path, 'largest_companies')
+    etl.clean_frame(df)
+    df.rename(columns=etl.largest_comp_col['columns'], inplace=True)
+
+    return df, etl.get_partial_aggregates(df)
+
 
 # Script entry point
 if __name__ == '__main__':
     '''
-    Executes the entire ETL and the sanity check.
-    The data will be extracted, cleaned and exported to CSV.
+    Executes the entire ETL, and the sanity check when enabled in the configuration.
+    The data will be extracted, cleaned and exported to CSV. See cli.py to also export the summaries.
     '''
     config = get_config()
-    etl = Etl(config=config, input_dir=input_dir)
+    Logger(config).set_log()
+    configure_instrumentation(config)
+    etl = Etl(config=config, input_dir=config['folders']['input_folder'])
     etl.run()
-    etl.sanity_check()
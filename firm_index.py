@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+
+
+class FirmIndex:
+    """
+    Sorted positions of the firms on some metric columns, for top-N and threshold queries in
+    O(log n + k) instead of sorting or masking the whole summary on every call.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns: list) -> None:
+        """
+        Build the index; only the metric columns of the dataframe are kept.
+
+        :param df: the firms summary.
+        :param columns: the metric columns to index.
+        """
+
+        self.size = len(df)
+        self.values = {}
+        self.order = {}
+        self.sorted_values = {}
+        self.valid = {}
+
+        for column in columns:
+            values = df[column].to_numpy(dtype='float64')
+            self.values[column] = values
+
+            # Positions by decreasing value, ties in row order, missing values last
+            order = np.argsort(-values, kind='stable')
+            self.order[column] = order
+            # Negated to be increasing, as searchsorted expects
+            self.sorted_values[column] = -values[order]
+            self.valid[column] = int(np.count_nonzero(~np.isnan(values)))
+
+    def __len__(self) -> int:
+        return self.size
+
+    def top(self, column: str, n: int) -> np.ndarray:
+        """
+        Find the rows with the highest values of a column.
+
+        :param column: the indexed column.
+        :param n: the number of rows.
+        :return: the positions of the `n` rows with the highest values, in decreasing order.
+        """
+
+        return self.order[column][:min(n, self.valid[column])]
+
+    def at_most(self, column: str, value: float) -> np.ndarray:
+        """
+        Find the rows whose value of a column is lower than or equal to a threshold.
+
+        :param column: the indexed column.
+        :param value: the threshold.
+        :return: the positions of the rows, in decreasing order of the column.
+        """
+
+        start = np.searchsorted(self.sorted_values[column], -value, side='left')
+        return self.order[column][start:self.valid[column]]
+
+    def filter_at_most(self, thresholds: dict) -> np.ndarray:
+        """
+        Find the rows whose values are lower than or equal to a threshold for every column.
+
+        The most selective column is looked up in the index and the others are only checked on
+        the rows it returns.
+        :param thresholds: mapping of indexed columns to their threshold.
+        :return: the positions of the rows, in row order.
+        """
+
+        candidates = {column: self.at_most(column, value) for column, value in thresholds.items()}
+        selective = min(candidates, key=lambda column: len(candidates[column]))
+        positions = candidates[selective]
+
+        for column, value in thresholds.items():
+            if column != selective:
+                positions = positions[self.values[column][positions] <= value]
+
+        return np.sort(positions)
@@ -1,9 +1,18 @@
 import os
+import glob
+import json
+import hashlib
+import importlib.util
 import yaml
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 
 from typing import Dict
 
+# File extension of each supported output format (Feather is the Arrow IPC file format)
+OUTPUT_FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+
 
 def get_serialized_data(path: str) -> Dict:
     """
@@ -13,7 +22,7 @@ def get_serialized_data(path: str) -> Dict:
     into a Python dictionary or list (depending on the format). The following file extensions are supported:
     - `.yaml` or `.yml` (YAML format)
     - `.json` (JSON format)
-    - `.toml` (TOML format)
+    - `.toml` (TOML format, read with tomllib, or the tomli package before Python 3.11)
 
     If the file extension is unsupported, a `ValueError` is raised.
 
@@ -25,17 +34,301 @@ def get_serialized_data(path: str) -> Dict:
     """
     _, extension = os.path.splitext(path)
 
+    if extension == ".toml":
+        try:
+            import tomllib
+        except ImportError:  # Python < 3.11
+            import tomli as tomllib
+
+        # tomllib only reads binary files
+        with open(path, mode="rb") as file:
+            return tomllib.load(file)
+
     with open(path, mode="r", encoding="utf-8") as file:
-        if extension == ".yaml":
+        if extension in (".yaml", ".yml"):
             return yaml.safe_load(file)
         elif extension == ".json":
             return json.load(file)
-        elif extension == ".toml":
-            return toml.load(file)
 
         raise ValueError(f"Unsupported file extension {extension} | file={path}")
 
 
+def read_csv_with_schema(path, schema: dict, engine: str = None, **kwargs) -> pd.DataFrame:
+    """
+    Read a CSV file with explicit dtypes instead of letting pandas infer them.
+
+    The pyarrow engine is only used when the package is installed and the options allow it
+    (it does not support reading by chunks); otherwise the default C engine is used.
+    :param path: the CSV file path or buffer.
+    :param schema: mapping of column names to dtypes (e.g. float64, float32, category).
+    :param engine: the preferred CSV engine, or None for the default one.
+    :param kwargs: other arguments passed to `pd.read_csv`.
+    :return: the dataframe, or an iterator of dataframes when `chunksize` is given.
+    """
+    if engine == 'pyarrow' and ('chunksize' in kwargs or importlib.util.find_spec('pyarrow') is None):
+        engine = None
+
+    return pd.read_csv(path, sep=',', dtype=schema, engine=engine, **kwargs)
+
+
+def get_output_path(folder: str, file_name: str, output_format: str) -> str:
+    """
+    Build the path of an output file, with the extension of the chosen format.
+
+    :param folder: the output folder.
+    :param file_name: the file name from the configuration (its extension is replaced).
+    :param output_format: one of csv, parquet or feather.
+    :return: the full path of the output file.
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unsupported output format {output_format} | file={file_name}")
+
+    root, _ = os.path.splitext(file_name)
+    return os.path.join(folder, root + OUTPUT_FORMATS[output_format])
+
+
+def get_partition_path(folder: str, file_name: str, output_format: str, column: str, value) -> str:
+    """
+    Build the path of one partition of an output file partitioned on a column, e.g. per year.
+
+    The partitions are stored in a folder named after the file, as `<column>=<value>` files.
+    :param folder: the output folder.
+    :param file_name: the file name from the configuration (its extension is replaced).
+    :param output_format: one of csv, parquet or feather.
+    :param column: the partitioning column.
+    :param value: the value of the column in the partition.
+    :return: the full path of the partition file.
+    """
+
+    root, _ = os.path.splitext(get_output_path(folder, file_name, output_format))
+    return get_output_path(root, f'{column}={value}', output_format)
+
+
+def get_schema(config: dict) -> dict:
+    """
+    Return the schema section of the configuration, with the year column added to each dataset
+    in panel mode, and Arrow strings read as objects when pyarrow is not installed.
+
+    :param config: the project configuration.
+    :return: mapping of each dataset to the dtypes of its columns, and the CSV engine.
+    """
+
+    panel = config['panel']
+    arrow_strings = importlib.util.find_spec('pyarrow') is not None
+
+    schema = dict(config['schema'])
+    for name, dtypes in config['schema'].items():
+        if not isinstance(dtypes, dict):
+            continue
+
+        if not arrow_strings:
+            dtypes = {column: 'object' if dtype == 'string[pyarrow]' else dtype for column, dtype in dtypes.items()}
+
+        if panel['enabled']:
+            # The raw inputs name the column as in the CSV files, the outputs as once cleaned
+            year = panel['year_column'] if name in ('financial_indicators', 'largest_companies') else panel['year']
+            dtypes = {**dtypes, year: panel['year_dtype']}
+
+        schema[name] = dtypes
+
+    return schema
+
+
+def get_float32_columns(df: pd.DataFrame, columns: list, decimals: int = None) -> list:
+    """
+    Find the float64 columns which can be stored as float32, in half the memory, and given back
+    unchanged by `restore_float64`: every value has at most `decimals` decimals and is found
+    again once converted to float32, back to float64 and rounded to `decimals`.
+
+    :param df: the dataframe.
+    :param columns: the candidate columns; the missing and non float64 ones are skipped.
+    :param decimals: the precision of the values, None to require values exactly representable as float32.
+    :return: the columns which can be converted.
+    """
+
+    convertible = []
+
+    for column in columns:
+        if column not in df.columns or df[column].dtype != 'float64':
+            continue
+
+        values = df[column].to_numpy()
+        restored = values.astype('float32').astype('float64')
+        if decimals is not None:
+            restored = restored.round(decimals)
+
+        if np.array_equal(restored, values, equal_nan=True):
+            convertible.append(column)
+
+    return convertible
+
+
+def restore_float64(df: pd.DataFrame, columns: list, decimals: int = None) -> pd.DataFrame:
+    """
+    Convert the columns stored as float32 after `get_float32_columns` back to their float64 values.
+
+    :param df: the dataframe.
+    :param columns: the candidate columns; the missing and non float32 ones are skipped.
+    :param decimals: the precision given to `get_float32_columns`.
+    :return: the dataframe itself when no column is float32, otherwise a copy sharing the other columns.
+    """
+
+    columns = [column for column in columns if column in df.columns and df[column].dtype == 'float32']
+    if not columns:
+        return df
+
+    df = df.copy(deep=False)
+    for column in columns:
+        values = df[column].astype('float64')
+        df[column] = values if decimals is None else values.round(decimals)
+
+    return df
+
+
+def write_frame(df: pd.DataFrame, path: str, output_format: str) -> None:
+    """
+    Write a dataframe in one of the output formats, without its index.
+
+    :param df: the dataframe to write.
+    :param path: the destination file path.
+    :param output_format: one of csv, parquet or feather.
+    :return: none
+    """
+    if output_format == 'csv':
+        df.to_csv(path, index=False)
+    elif output_format == 'parquet':
+        df.to_parquet(path, index=False)
+    elif output_format == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        raise ValueError(f"Unsupported output format {output_format} | file={path}")
+
+
+def read_frame(path: str, output_format: str, schema: dict, columns: list = None, memory_map: bool = False,
+               engine: str = None) -> pd.DataFrame:
+    """
+    Read a dataframe written by `write_frame`, loading only the requested columns.
+
+    Parquet and Feather files keep their dtypes and are converted from Arrow without consolidating
+    the columns, so numeric columns without missing values are not copied; Feather files can
+    additionally be memory-mapped. The schema is applied to the columns whose dtype differs.
+    :param path: the file path.
+    :param output_format: one of csv, parquet or feather.
+    :param schema: mapping of column names to dtypes.
+    :param columns: the columns to load, or None for all of them.
+    :param memory_map: whether to memory-map the file instead of reading it in memory.
+    :param engine: the CSV engine, see `read_csv_with_schema`.
+    :return: the dataframe.
+    """
+    if columns is not None:
+        schema = {col: dtype for col, dtype in schema.items() if col in columns}
+
+    if output_format == 'csv':
+        return read_csv_with_schema(path, schema, engine=engine, usecols=columns)
+
+    if output_format == 'parquet':
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    elif output_format == 'feather':
+        import pyarrow.feather as feather
+        table = feather.read_table(path, columns=columns, memory_map=memory_map)
+    else:
+        raise ValueError(f"Unsupported output format {output_format} | file={path}")
+
+    df = table.to_pandas(split_blocks=True)
+    return df.astype({col: dtype for col, dtype in schema.items() if str(df[col].dtype) != dtype}, copy=False)
+
+
+def read_partitions(folder: str, file_name: str, output_format: str, schema: dict, columns: list = None,
+                    memory_map: bool = False, engine: str = None) -> pd.DataFrame:
+    """
+    Read every partition of an output file written with `get_partition_path`, in partition order.
+
+    :param folder: the output folder.
+    :param file_name: the file name from the configuration.
+    :param output_format: one of csv, parquet or feather.
+    :param schema: mapping of column names to dtypes.
+    :param columns: the columns to load, or None for all of them.
+    :param memory_map: whether to memory-map the files instead of reading them in memory.
+    :param engine: the CSV engine, see `read_csv_with_schema`.
+    :return: the concatenated partitions.
+    """
+
+    root, _ = os.path.splitext(get_output_path(folder, file_name, output_format))
+    paths = sorted(glob.glob(os.path.join(root, '*' + OUTPUT_FORMATS[output_format])))
+    if not paths:
+        raise FileNotFoundError(f'No partition of {file_name} in {folder}')
+
+    return concat_frames([read_frame(path, output_format, schema, columns=columns, memory_map=memory_map,
+                                     engine=engine)
+                          for path in paths])
+
+
+class FrameWriter:
+    """
+    Writes a dataframe to a file chunk by chunk, in one of the output formats.
+
+    Categorical columns are written as plain values, since each chunk has its own categories;
+    the schema restores them when the file is read.
+    """
+
+    def __init__(self, path: str, output_format: str) -> None:
+        """
+        Initialize the writer; the file is created with the first chunk.
+
+        :param path: the destination file path.
+        :param output_format: one of csv, parquet or feather.
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported output format {output_format} | file={path}")
+
+        self.path = path
+        self.output_format = output_format
+        self.writer = None
+        self.schema = None
+        self.rows = 0
+
+    def write(self, df: pd.DataFrame) -> None:
+        """
+        Append a chunk to the file.
+
+        :param df: the chunk, with the same columns as the previous ones.
+        :return: none
+        """
+        df = df.astype({col: 'object' for col in df.select_dtypes('category').columns})
+
+        if self.output_format == 'csv':
+            df.to_csv(self.path, mode='w' if self.rows == 0 else 'a', header=(self.rows == 0), index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self.writer is None:
+                if df.empty:
+                    return  # the Arrow schema cannot be inferred from an empty chunk
+
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                self.schema = table.schema
+                self.writer = (pq.ParquetWriter(self.path, self.schema) if self.output_format == 'parquet'
+                               else pa.ipc.new_file(self.path, self.schema))
+            else:
+                table = pa.Table.from_pandas(df, schema=self.schema, preserve_index=False)
+
+            self.writer.write_table(table)
+
+        self.rows += len(df)
+
+    def close(self) -> None:
+        """
+        Finish the file. An empty file with no columns is created if nothing was written.
+        :return: none
+        """
+        if self.writer is not None:
+            self.writer.close()
+        elif self.rows == 0:
+            write_frame(pd.DataFrame(), self.path, self.output_format)
+
+
 def compute_ratio(df:pd.DataFrame, num: str, denom: str, result: float, x=1) -> pd.DataFrame:
     """
     Compute the ratio between two columns.
@@ -50,3 +343,264 @@ def compute_ratio(df:pd.DataFrame, num: str, denom: str, result: float, x=1) ->
     return df
 
 
+def get_correlation_matrix(values: np.ndarray, method: str = 'pearson') -> np.ndarray:
+    """
+    Compute the correlation matrix of the columns of a float array, like `DataFrame.corr`.
+
+    Missing values are handled pairwise: each coefficient only uses the rows where both columns
+    are known. The Pearson coefficients of all pairs are computed at once with matrix products.
+    The Spearman coefficients are the Pearson coefficients of the ranks; for the pairs involving
+    a column with missing values, the ranks are recomputed on the rows where both are known.
+    :param values: the array, one column per variable, NaN for missing values.
+    :param method: pearson or spearman.
+    :return: the square matrix of the coefficients, NaN where a pair has too few values.
+    """
+
+    if method not in ('pearson', 'spearman'):
+        raise ValueError(f"Unsupported correlation method {method}")
+
+    values = np.asarray(values, dtype='float64')
+    valid = ~np.isnan(values)
+
+    if method == 'pearson':
+        return _get_pearson_matrix(values, valid)
+
+    # One row per column from here, so that each column is contiguous in memory
+    values = np.ascontiguousarray(values.T)
+    valid = ~np.isnan(values)
+    n_columns, n_rows = values.shape
+    positions = np.arange(n_rows)
+
+    # Sort each column once (NumPy puts the missing values last). Ranking any subset of the values of
+    # a column then only needs, for each sorted position, the first and last positions of its ties.
+    order = np.argsort(values, axis=1, kind='stable')
+    sorted_values = np.take_along_axis(values, order, axis=1)
+
+    starts = np.ones(values.shape, dtype=bool)
+    starts[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    ends = np.ones(values.shape, dtype=bool)
+    ends[:, :-1] = starts[:, 1:]
+
+    first = np.maximum.accumulate(np.where(starts, positions, 0), axis=1)
+    last = np.minimum.accumulate(np.where(ends, positions, n_rows - 1)[:, ::-1], axis=1)[:, ::-1]
+
+    ranks = _get_subset_ranks(order, first, last, np.take_along_axis(valid, order, axis=1))
+    corr = _get_pearson_matrix(ranks.T, valid.T)
+
+    # The pairs with a column with missing values are ranked again on the values where both are known
+    for i in np.flatnonzero(~valid.all(axis=1)):
+        both = valid & valid[i]
+
+        # Ranks of column i, and of each other column, on the values known in both
+        ranks_i = _get_subset_ranks(order[[i]], first[[i]], last[[i]], both[:, order[i]])
+        ranks_other = _get_subset_ranks(order, first, last, np.take_along_axis(both, order, axis=1))
+
+        pair_corr = _get_pearson_rows(ranks_i, ranks_other, both)
+        pair_corr[i] = corr[i, i]
+        corr[i, :] = corr[:, i] = pair_corr
+
+    return corr
+
+
+def _get_subset_ranks(order: np.ndarray, first: np.ndarray, last: np.ndarray, selected: np.ndarray) -> np.ndarray:
+    """
+    Rank a subset of the values of each row from 1, giving tied values the average of their ranks,
+    like `Series.rank`.
+
+    :param order: the positions of the values of each row sorted by value; with a single row,
+                  it is used for every row of `selected`.
+    :param first: for each sorted position, the first position of the values tied with it.
+    :param last: for each sorted position, the last position of the values tied with it.
+    :param selected: boolean array in sorted order, True for the values to rank.
+    :return: the rank of each value of the subset, NaN for the other values, in the original order.
+    """
+
+    # Number of selected values up to each sorted position, and before it (with a leading 0)
+    counts = np.zeros((selected.shape[0], selected.shape[1] + 1), dtype='int32')
+    np.cumsum(selected, axis=1, out=counts[:, 1:])
+
+    ranks_sorted = (np.take_along_axis(counts, np.broadcast_to(first, selected.shape), axis=1) + 1
+                    + np.take_along_axis(counts, np.broadcast_to(last + 1, selected.shape), axis=1)) / 2
+    ranks_sorted[~selected] = np.nan
+
+    ranks = np.empty(selected.shape)
+    np.put_along_axis(ranks, np.broadcast_to(order, selected.shape), ranks_sorted, axis=1)
+
+    return ranks
+
+
+def _get_pearson_rows(x: np.ndarray, y: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Compute the Pearson correlation between each row of `x` and the same row of `y`.
+
+    :param x: the first array, NaN where `valid` is False.
+    :param y: the second array, of the same shape, NaN where `valid` is False.
+    :param valid: boolean array, True where both values are known.
+    :return: one coefficient per row.
+    """
+
+    count = valid.sum(axis=1)
+    x = np.nan_to_num(x, nan=0.0)
+    y = np.nan_to_num(y, nan=0.0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x -= (x.sum(axis=1) / count)[:, None]
+        y -= (y.sum(axis=1) / count)[:, None]
+        x *= valid
+        y *= valid
+        corr = np.einsum('ij,ij->i', x, y) / np.sqrt(np.einsum('ij,ij->i', x, x) * np.einsum('ij,ij->i', y, y))
+
+    corr[count < 2] = np.nan
+
+    return np.clip(corr, -1, 1)
+
+
+def _get_pearson_matrix(values: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """
+    Compute the pairwise complete Pearson correlation matrix of the columns of an array.
+
+    :param values: the array, one column per variable.
+    :param valid: boolean array, False where a value is missing.
+    :return: the square matrix of the coefficients.
+    """
+
+    known = valid.astype('float64')
+
+    # Centering on the column means changes no coefficient but avoids cancellation errors
+    means = np.where(valid, values, 0.0).sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    x = np.where(valid, values - means, 0.0)
+
+    # [i, j] entries: over the rows where both columns i and j are known
+    count = known.T @ known
+    sum_x = x.T @ known
+    sum_xx = (x * x).T @ known
+    sum_xy = x.T @ x
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = sum_xy - sum_x * sum_x.T / count
+        variance = sum_xx - sum_x ** 2 / count
+        corr = covariance / np.sqrt(variance * variance.T)
+
+    corr[count < 2] = np.nan
+
+    return np.clip(corr, -1, 1)
+
+
+def get_files_hash(paths: list, block_size: int = 1 << 20) -> str:
+    """
+    Compute a single content hash over several files.
+
+    The files are read in blocks so large inputs do not need to fit in memory. Missing files are
+    hashed by name only, so creating them later changes the result.
+    :param paths: the list of file paths to hash, in a stable order.
+    :param block_size: the number of bytes read at a time.
+    :return: the hexadecimal SHA-256 digest of the files content.
+    """
+    digest = hashlib.sha256()
+
+    for path in paths:
+        digest.update(path.encode('utf-8'))
+        if not os.path.exists(path):
+            continue
+
+        with open(path, mode='rb') as file:
+            for block in iter(lambda: file.read(block_size), b''):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+
+def get_files_signature(paths: list) -> str:
+    """
+    Describe the current version of several files from their modification time and size.
+
+    Much cheaper than `get_files_hash` for large files such as databases; missing files are skipped.
+    :param paths: the list of file paths.
+    :return: a string that changes whenever one of the files is modified.
+    """
+    signature = []
+
+    for path in paths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature.append(f'{path}:{stat.st_mtime_ns}:{stat.st_size}')
+
+    return '|'.join(signature)
+
+
+# The last content hash of each list of files, with the signature of the files it was computed for
+_files_hashes = {}
+
+
+def get_cached_files_hash(paths: list) -> str:
+    """
+    Compute the content hash of several files, only reading them again when their signature changed.
+
+    The content hash stays the identity of the files, the signature from `get_files_signature` only
+    decides whether it must be recomputed, so polling or rerunning does not read large inputs again.
+    :param paths: the list of file paths to hash, in a stable order.
+    :return: the hexadecimal SHA-256 digest of the files content.
+    """
+    key = tuple(paths)
+    signature = get_files_signature(paths)
+    cached = _files_hashes.get(key)
+
+    if cached is None or cached[0] != signature:
+        cached = (signature, get_files_hash(paths))
+        _files_hashes[key] = cached
+
+    return cached[1]
+
+
+def get_partial_means(df: pd.DataFrame, by) -> pd.DataFrame:
+    """
+    Compute the running sums and counts needed to rebuild a `groupby(by).mean()`.
+
+    Partial results computed on separate pieces of a dataset can be added together with
+    `combine_partial_means` and turned into means with `finalize_partial_means`.
+    :param df: dataframe containing the data.
+    :param by: the column (or list of columns) to group on.
+    :return: a dataframe indexed by group with ('sum', column) and ('count', column) columns.
+    """
+    keys = by if isinstance(by, list) else [by]
+    columns = [col for col in df.select_dtypes('number').columns if col not in keys]
+
+    grouped = df.groupby(by, observed=True)[columns]
+    return pd.concat({'sum': grouped.sum(), 'count': grouped.count()}, axis=1)
+
+
+def combine_partial_means(partials: list) -> pd.DataFrame:
+    """
+    Add together several partial results produced by `get_partial_means`.
+    :param partials: the list of partial dataframes.
+    :return: the combined partial dataframe, indexed by group.
+    """
+    df = pd.concat(partials)
+    return df.groupby(level=list(range(df.index.nlevels)), observed=True).sum()
+
+
+def finalize_partial_means(partial: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turn partial sums and counts into means, in the layout of `groupby(by, as_index=False).mean()`.
+    :param partial: the partial dataframe produced by `get_partial_means` or `combine_partial_means`.
+    :return: the dataframe with the group columns followed by the mean of each column.
+    """
+    return (partial['sum'] / partial['count']).reset_index()
+
+
+def concat_frames(frames: list) -> pd.DataFrame:
+    """
+    Concatenate dataframes read separately, keeping their categorical columns categorical.
+
+    pandas falls back to object columns when the categories differ between the dataframes, so
+    the categories are first unified.
+    :param frames: the dataframes, with the same columns and dtypes.
+    :return: the concatenated dataframe.
+    """
+
+    for column, dtype in frames[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            categories = union_categoricals([df[column] for df in frames], sort_categories=True).categories
+            frames = [df.assign(**{column: df[column].cat.set_categories(categories)}) for df in frames]
+
+    return pd.concat(frames, ignore_index=True)
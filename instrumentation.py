@@ -0,0 +1,140 @@
+"""
+This module measures the ETL and Model stages.
+
+Each call of a method decorated with `instrumented` records its wall time, CPU time, allocated
+memory (when tracemalloc is enabled), the peak RSS of the process and the number of rows it
+produced. Records are kept in memory for the diagnostics page and written as JSON lines to
+the metrics file set in the configuration.
+"""
+
+import os
+import json
+import time
+import logging
+import functools
+import tracemalloc
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Records of the instrumented calls made by this process
+records = []
+
+# JSON lines logger, configured by `configure`
+metrics_logger = logging.getLogger('metrics')
+metrics_logger.propagate = False
+
+settings = {'enabled': True}
+
+
+def configure(config: dict) -> None:
+    """
+    Apply the instrumentation section of the configuration.
+
+    :param config: the project configuration.
+    :return: none
+    """
+
+    instrumentation = config['instrumentation']
+    settings['enabled'] = instrumentation['enabled']
+
+    if instrumentation['trace_memory'] and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    if instrumentation['metrics_file'] and not metrics_logger.handlers:
+        metrics_path = os.path.join(config['folders']['output_folder'], instrumentation['metrics_file'])
+        os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+
+        handler = logging.FileHandler(metrics_path, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        metrics_logger.addHandler(handler)
+        metrics_logger.setLevel(logging.INFO)
+
+
+def get_peak_rss_mb() -> float:
+    """
+    Return the peak resident memory of the process, or NaN where it is not available.
+    :return: the peak RSS in MB.
+    """
+
+    if resource is None:
+        return float('nan')
+
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def instrumented(stage: str = None, rows=None):
+    """
+    Decorator recording the duration, memory and output size of each call of a method.
+
+    :param stage: the name of the stage, defaults to the class and method names.
+    :param rows: optional function (self, result) returning the number of rows produced;
+                 by default the length of the result when it is a DataFrame.
+    :return: the decorator.
+    """
+
+    def decorator(method):
+        name = stage or method.__qualname__
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not settings['enabled']:
+                return method(self, *args, **kwargs)
+
+            if tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+                memory_start = tracemalloc.get_traced_memory()[0]
+
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+
+            result = method(self, *args, **kwargs)
+
+            record = {
+                'stage': name,
+                'timestamp': time.time(),
+                'wall_seconds': round(time.perf_counter() - wall_start, 6),
+                'cpu_seconds': round(time.process_time() - cpu_start, 6),
+                'traced_peak_mb': (round((tracemalloc.get_traced_memory()[1] - memory_start) / 1e6, 3)
+                                   if tracemalloc.is_tracing() else None),
+                'peak_rss_mb': round(get_peak_rss_mb(), 1),
+                'rows': (rows(self, result) if rows is not None
+                         else len(result) if isinstance(result, pd.DataFrame) else None),
+            }
+
+            records.append(record)
+            metrics_logger.info(json.dumps(record))
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def get_summary() -> pd.DataFrame:
+    """
+    Summarize the recorded calls per stage.
+    :return: one row per stage with the number of calls, the total and mean times, the highest
+             memory figures and the rows produced by the last call.
+    """
+
+    if not records:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(records)
+
+    return (df.groupby('stage', sort=False)
+            .agg(calls=('stage', 'size'),
+                 total_wall_seconds=('wall_seconds', 'sum'),
+                 mean_wall_seconds=('wall_seconds', 'mean'),
+                 total_cpu_seconds=('cpu_seconds', 'sum'),
+                 max_traced_peak_mb=('traced_peak_mb', 'max'),
+                 peak_rss_mb=('peak_rss_mb', 'max'),
+                 last_rows=('rows', 'last'))
+            .round(4)
+            .reset_index())
@@ -12,5 +12,6 @@ class Logger:
         Set the logger.
         :return: None
         """
-        logging.basicConfig(filename='logger.log', level=logging.INFO,
+        # DEBUG also enables the ETL diagnostics (column listings, statistics of the sanity check)
+        logging.basicConfig(filename='logger.log', level=self.config['logger']['level'],
                             format = self.config['logger']['format'], filemode='w')
\ No newline at end of file
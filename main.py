@@ -1,14 +1,168 @@
+import os
 import logging
+import pandas as pd
 import streamlit as st
+import instrumentation
 
 from logger import Logger
-from etl import Etl
 from model import Model
 from view import View
-from constants import output_path, database_path, input_dir
-from repository import get_config, Repository
+from constants import output_path, database_path, input_dir, config_file
+from helpers import get_cached_files_hash, get_files_signature
+from configuration import get_config
+from repository import Repository
+from snapshot import get_current_snapshot
+from watcher import LiveData
 
-config = get_config()
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def build_pipeline(inputs_hash: str, _config: dict) -> tuple:
+    """
+    Run the ETL, load the outputs and export them to SQLite, once per version of the inputs.
+
+    Streamlit re-executes the script on every interaction; the result is kept in a process-wide
+    resource cache shared by all sessions and is only rebuilt when `inputs_hash` changes.
+    :param inputs_hash: content hash of the input CSV files and of the configuration file.
+    :param _config: the project configuration, not hashed by Streamlit since `inputs_hash` covers it.
+    :return: the loaded Repository and Model.
+    """
+
+    # The ETL is only imported when the dashboard does not start from a snapshot
+    from etl import Etl
+
+    logging.info(f'building pipeline for inputs {inputs_hash}')
+
+    etl = Etl(config=_config, input_dir=input_dir)
+    etl.run()
+    logging.info('ETL completed')
+
+    # The export reads the files just written by the ETL, whatever backend the dashboard reads
+    repo = Repository(_config, output_path, columns=Model.get_required_columns(_config), backend='files')
+    repo.get_data()
+    logging.info('Data loaded')
+
+    model = Model(_config, repo)
+    if model.export_datasets_to_sqlite(database_path):
+        logging.info('Data exported to SQLite')
+
+        # The View displays the summaries materialized by the export
+        repo.get_summaries()
+
+    return repo, model
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def load_database(path: str, signature: str, _config: dict) -> tuple:
+    """
+    Load the Repository and Model straight from a SQLite database or snapshot, without running the ETL.
+
+    :param path: path to the database.
+    :param signature: version of the database, e.g. the modification time and size of its files,
+                      used with the path as cache key.
+    :param _config: the project configuration, not hashed by Streamlit.
+    :return: the loaded Repository and Model.
+    """
+
+    return open_database(_config, path)
+
+
+def open_database(config: dict, path: str) -> tuple:
+    """
+    Load a Repository and a Model from the tables and summaries of a SQLite database.
+
+    :param config: the project configuration.
+    :param path: path to the database.
+    :return: the loaded Repository and Model.
+    """
+
+    logging.info(f'loading data from {path}')
+
+    repo = Repository(config, output_path, columns=Model.get_required_columns(config), backend='sqlite',
+                      database_path=path)
+    repo.get_data()
+    repo.get_summaries()
+    logging.info('Data loaded')
+
+    return repo, Model(config, repo)
+
+
+def load_data(config: dict) -> tuple:
+    """
+    Load the data of the dashboard from the current snapshot, from the SQLite database with the
+    sqlite backend, or else by running the pipeline when the inputs changed.
+
+    :param config: the project configuration.
+    :return: the loaded Repository and Model.
+    """
+
+    snapshot = get_current_snapshot(config) if config['snapshot']['enabled'] else None
+
+    if snapshot is not None:
+        # Snapshots are never modified, their version identifies their content
+        return load_database(snapshot['path'], snapshot['version'], config)
+
+    if config['repository']['backend'] == 'sqlite' and os.path.exists(database_path):
+        return load_database(database_path, get_files_signature([database_path, f'{database_path}-wal']), config)
+
+    if config['snapshot']['enabled']:
+        logging.warning('no snapshot found, run snapshot.py to build one; running the ETL')
+
+    from etl import Etl
+
+    # Only rebuild the pipeline when one of the inputs or the configuration has changed, the inputs
+    # are only hashed again when their modification time or size changed since the last rerun
+    input_paths = Etl(config=config, input_dir=input_dir).get_input_paths()
+    inputs_hash = get_cached_files_hash([config_file] + input_paths)
+
+    return build_pipeline(inputs_hash, config)
+
+
+def rebuild_data(config: dict) -> tuple:
+    """
+    Run the headless pipeline and load what it exported, in the watcher thread: the new snapshot,
+    the database with the sqlite backend, or else the ETL output files and the summaries.
+
+    The datasets and the summaries are all read before the new pair is served, so it never reads
+    the database again, which the next rebuild rewrites while pages may still use this pair.
+    :param config: the project configuration.
+    :return: the new Repository and Model, or None if the pipeline failed.
+    """
+
+    from cli import run_pipeline
+
+    if not run_pipeline(config, config_file):
+        return None
+
+    snapshot = get_current_snapshot(config) if config['snapshot']['enabled'] else None
+
+    if snapshot is not None or config['repository']['backend'] == 'sqlite':
+        return open_database(config, snapshot['path'] if snapshot is not None else database_path)
+
+    repo = Repository(config, output_path, columns=Model.get_required_columns(config), backend='files')
+    repo.get_data()
+    repo.get_summaries()
+
+    return repo, Model(config, repo)
+
+
+@st.cache_resource(show_spinner=False)
+def get_live_data(_config: dict) -> LiveData:
+    """
+    Load the data and start rebuilding it in the background when the input files change, once
+    per process.
+
+    :param _config: the project configuration, not hashed by Streamlit.
+    :return: the data served to every session.
+    """
+
+    from etl import Etl
+
+    watcher_config = _config['watcher']
+    etl = Etl(config=_config, input_dir=input_dir)
+
+    return LiveData(load=lambda: load_data(_config), rebuild=lambda: rebuild_data(_config),
+                    get_paths=etl.get_input_paths, poll_interval=watcher_config['poll_interval'],
+                    debounce=watcher_config['debounce'])
 
 
 class Main:
@@ -26,26 +180,22 @@ class Main:
 
         self.config = get_config()
         Logger(self.config).set_log()
+        instrumentation.configure(self.config)
         logging.info('initializing')
 
-        etl = Etl(config=config, input_dir=input_dir)
-        etl.run()
-        logging.info('ETL completed')
-
-        self.repo = Repository(self.config, output_path)
-        self.repo.get_data()
-        logging.info('Data loaded')
-
-        self.model = Model(self.config, self.repo)
-        self.model.export_datasets_to_sqlite(database_path)
-        logging.info('Data exported to SQLite')
+        if self.config['watcher']['enabled']:
+            # Taken once per page run, so a rebuild finishing meanwhile does not mix two versions
+            self.repo, self.model = get_live_data(self.config).current
+        else:
+            self.repo, self.model = load_data(self.config)
 
         self.view = View(self.config)
         self.view.set_model(self.model)
+        self.view.set_repository(self.repo)
 
         # Store specific config sections for UI elements
         self.streamlit_config = self.config['streamlit']
-        self.streamlit_widgets_config = self.streamlit_config["widgets"]
+        self.streamlit_widgets_config = self.config.widgets
 
 
     def run(self) -> None:
@@ -57,6 +207,11 @@ class Main:
         :return: none
         """
 
+        # Hidden diagnostics page, opened by adding the query parameter to the URL
+        if self.streamlit_widgets_config['diagnostics']['query_param'] in st.query_params:
+            self.show_diagnostics()
+            return
+
         data = self.streamlit_widgets_config['options']   # Available datasets for selection
 
         # Sidebar radio button for dataset choice
@@ -131,11 +286,8 @@ class Main:
 
                     logging.info(f'filtering firms with ROA <= {threshold_roa} and Efficiency <= {threshold_eff}')
 
-                    df_plot = self.model.get_firms_financial_summary()
-                    df_plot = df_plot[
-                        (df_plot[self.model.firms_financial_summary_table['asset_efficiency']] <= threshold_roa) &
-                        (df_plot[self.model.firms_financial_summary_table['return_on_assets']] <= threshold_eff)
-                    ]
+                    df_plot = self.model.get_filtered_firms_summary(max_asset_efficiency=threshold_roa,
+                                                                    max_return_on_assets=threshold_eff)
 
                     self.view.plot_roa_vs_efficiency(df_plot)
                     logging.info('displayed chart: Plot vs ROA efficiency')
@@ -145,6 +297,23 @@ class Main:
                     logging.info('displayed chart: Plot Top10 ROA')
 
 
+    def show_diagnostics(self) -> None:
+        """
+        Display the measures recorded for each ETL and Model stage by this process.
+        :return: none
+        """
+
+        diagnostics_config = self.streamlit_widgets_config['diagnostics']
+
+        st.subheader(diagnostics_config['title'], divider=self.streamlit_widgets_config['header']['divider'])
+
+        st.markdown(f"**{diagnostics_config['summary']}**")
+        st.dataframe(instrumentation.get_summary())
+
+        with st.expander(diagnostics_config['records'], expanded=False):
+            st.dataframe(pd.DataFrame(instrumentation.records))
+
+
 # Application execution entry point
 if __name__ == '__main__':
     app = Main()
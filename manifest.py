@@ -0,0 +1,212 @@
+import os
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+
+class RowHashIndex:
+    """
+    Sorted runs of row hashes supporting fast membership tests and insertions.
+
+    Each batch of new hashes is stored as its own sorted run, and the last runs are merged while
+    a run is not larger than the one after it, so there are O(log n) runs and every hash is only
+    copied O(log n) times instead of the whole index being copied on each insertion.
+    """
+
+    def __init__(self, hashes: np.ndarray = None) -> None:
+        """
+        Initialize the index.
+
+        :param hashes: optional hashes to start with.
+        """
+
+        self.runs = []
+        if hashes is not None:
+            self.add(hashes)
+
+    def __len__(self) -> int:
+        return sum(len(run) for run in self.runs)
+
+    def __setstate__(self, state: dict) -> None:
+        # Manifests written before the index was split in runs store a single sorted array
+        if 'hashes' in state:
+            state = {'runs': [state['hashes']] if len(state['hashes']) else []}
+        self.__dict__.update(state)
+
+    def contains(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Look up row hashes in the index, in O(log² n) per row.
+
+        :param hashes: the hashes of the rows to look up.
+        :return: a boolean array, True where the row is already in the index.
+        """
+
+        found = np.zeros(len(hashes), dtype=bool)
+
+        for run in self.runs:
+            positions = np.searchsorted(run, hashes).clip(max=len(run) - 1)
+            found |= run[positions] == hashes
+
+        return found
+
+    def add(self, hashes: np.ndarray) -> None:
+        """
+        Add row hashes, keeping every run sorted and the runs without duplicates.
+
+        :param hashes: the hashes of the new rows.
+        :return: none
+        """
+
+        hashes = np.unique(np.asarray(hashes, dtype='uint64'))
+        hashes = hashes[~self.contains(hashes)]
+        if not len(hashes):
+            return
+
+        self.runs.append(hashes)
+
+        # The runs hold distinct hashes, so merging two of them is a sort of their concatenation
+        while len(self.runs) > 1 and len(self.runs[-2]) <= len(self.runs[-1]):
+            run = self.runs.pop()
+            self.runs[-1] = np.sort(np.concatenate([self.runs[-1], run]), kind='stable')
+
+
+class EtlManifest:
+    """
+    Keeps track of what the incremental ETL has already processed.
+
+    The manifest stores the position reached in the company file, the hashes of the cleaned
+    company rows and the per-country running sums and counts used to compute the aggregated
+    means, so that appended rows can be processed without parsing the whole file again.
+    The processed part of the file is hashed on each run to detect edited or removed rows,
+    which costs a read of the file but no parsing. In panel mode, it stores the hash of the
+    input rows of each year instead.
+    """
+
+    # Number of bytes read at once when hashing the processed part of the company file
+    BLOCK_SIZE = 1 << 20
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize an empty manifest.
+
+        :param path: path of the file where the manifest is stored.
+        """
+
+        self.path = path
+
+        self.config_hash = None
+        self.financial_indicators_hash = None
+        self.companies_offset = 0
+        self.companies_prefix_hash = None
+        self.companies_header = None
+        self.row_hashes = RowHashIndex()
+        self.partial_means = pd.DataFrame()
+
+        # Hash of the input rows of each year, in panel mode
+        self.year_hashes = {}
+
+    def load(self) -> bool:
+        """
+        Load the manifest from disk if it exists.
+        :return: True if a manifest was found.
+        """
+
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path, mode='rb') as file:
+            self.__dict__.update(pickle.load(file))
+
+        return True
+
+    def save(self) -> None:
+        """
+        Write the manifest to disk, replacing the previous one atomically.
+        :return: none
+        """
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, mode='wb') as file:
+            pickle.dump({key: value for key, value in self.__dict__.items() if key != 'path'}, file)
+        os.replace(tmp_path, self.path)
+
+    def record_companies_file(self, path: str) -> None:
+        """
+        Remember the current end of the company file as the position already processed.
+
+        :param path: path to the company CSV file.
+        :return: none
+        """
+
+        with open(path, mode='rb') as file:
+            self.companies_header = file.readline()
+            self.companies_offset = os.path.getsize(path)
+            self.companies_prefix_hash = self._get_prefix_hash(file, self.companies_offset).hexdigest()
+
+    def read_appended_rows(self, path: str) -> bytes:
+        """
+        Read the complete lines appended to the company file and move the processed position after them.
+
+        :param path: path to the company CSV file.
+        :return: the CSV header followed by the appended lines.
+        """
+
+        with open(path, mode='rb') as file:
+            prefix_hash = self._get_prefix_hash(file, self.companies_offset)
+            data = file.read()
+
+            # Leave a partially written last line for the next run
+            data = data[:data.rfind(b'\n') + 1]
+            prefix_hash.update(data)
+            self.companies_offset += len(data)
+            self.companies_prefix_hash = prefix_hash.hexdigest()
+
+        return self.companies_header + data
+
+    def is_appended(self, path: str) -> bool:
+        """
+        Check that the company file only had rows appended since it was last processed.
+
+        Every byte up to the last processed position must be unchanged, so any edited or removed
+        row is detected, and the previous content must end with a complete line.
+        :param path: path to the company CSV file.
+        :return: True if only the bytes after `companies_offset` need to be processed.
+        """
+
+        if self.companies_prefix_hash is None or os.path.getsize(path) < self.companies_offset:
+            return False
+
+        with open(path, mode='rb') as file:
+            if file.readline() != self.companies_header:
+                return False
+
+            file.seek(self.companies_offset - 1)
+            if file.read(1) != b'\n':
+                return False
+
+            return self._get_prefix_hash(file, self.companies_offset).hexdigest() == self.companies_prefix_hash
+
+    def _get_prefix_hash(self, file, offset: int):
+        """
+        Hash the bytes preceding `offset` in an open binary file, leaving the file at `offset`.
+
+        :param file: the file object.
+        :param offset: the position where the prefix ends.
+        :return: the SHA-256 hash object, which can be updated with the following bytes.
+        """
+
+        digest = hashlib.sha256()
+        file.seek(0)
+
+        remaining = offset
+        while remaining > 0:
+            block = file.read(min(self.BLOCK_SIZE, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+
+        return digest
@@ -1,7 +1,36 @@
+import logging
+import functools
+import numpy as np
 import pandas as pd
 
-from helpers import compute_ratio
-from sqlalchemy import create_engine
+from helpers import compute_ratio, get_correlation_matrix
+from firm_index import FirmIndex
+from instrumentation import instrumented
+
+
+def memoized(method):
+    """
+    Cache the result of a Model method for the current version of the repository data.
+
+    The cache is dropped as soon as `Repository.get_data()` reloads the datasets. Cached DataFrames
+    are shared between callers and must not be modified in place.
+    :param method: the Model method to cache.
+    :return: the wrapped method.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._cache_version != self.repo.version:
+            self.clear_cache()
+
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        if key not in self._cache:
+            self._cache[key] = method(self, *args, **kwargs)
+
+        return self._cache[key]
+
+    return wrapper
+
 
 class Model:
     """
@@ -28,7 +57,74 @@ class Model:
         self.countries_financial_summary_table = self.config['countries_financial_summary_table']
         self.firms_financial_summary_table = self.config['firms_financial_summary_table']
 
+        # In panel mode, every metric is computed per year
+        self.year = self.config['panel']['year'] if self.config['panel']['enabled'] else None
 
+        # Results of the memoized methods for the repository data version `_cache_version`
+        self._cache = {}
+        self._cache_version = None
+
+    @staticmethod
+    def get_required_columns(config: dict) -> dict:
+        """
+        Lists the only columns of each repository dataset that the Model reads, so the
+        Repository can avoid loading the others.
+
+        :param config: Configuration dictionary.
+        :return: mapping of 'merged_table' and 'largest_companies' to column lists.
+        """
+
+        col_merged = config['merged_dataset']['columns']
+        col = config['largest_companies']['columns']
+        year = [config['panel']['year']] if config['panel']['enabled'] else []
+
+        return {
+            # Every indicator can be correlated, see `get_correlation`
+            'merged_table': list(col_merged.values()) + year,
+            'largest_companies': [col[key] for key in ('company', 'revenue_usd_millions',
+                                                       'total_asset_usd_millions', 'net_income_usd_millions')] + year,
+        }
+
+    def clear_cache(self) -> None:
+        """
+        Drop every memoized result, so that the next calls recompute from the repository data.
+        :return: none
+        """
+
+        self._cache = {}
+        self._cache_version = self.repo.version
+
+    def get_keys(self, key: str) -> list:
+        """
+        Return the key columns of a result: the country or the company, and the year in panel mode.
+
+        :param key: the country or company column.
+        :return: the key columns.
+        """
+
+        return [key] + ([self.year] if self.year else [])
+
+    def get_percentile_mask(self, values: np.ndarray, years: np.ndarray = None) -> np.ndarray:
+        """
+        Mask the values between the 5th and 95th percentiles, computed separately for each year
+        when `years` is given.
+
+        :param values: the values to filter.
+        :param years: optional year of each value.
+        :return: a boolean array, True for the values kept.
+        """
+
+        if years is None:
+            q1, q2 = np.nanquantile(values, [0.05, 0.95])
+        else:
+            bounds = pd.Series(values).groupby(years).quantile([0.05, 0.95]).unstack()
+            q1 = bounds[0.05].reindex(years).to_numpy()
+            q2 = bounds[0.95].reindex(years).to_numpy()
+
+        return (values >= q1) & (values <= q2)
+
+    @memoized
+    @instrumented()
     def get_revenue_to_gdp(self) -> pd.DataFrame:
         """
         Calculates the mean revenue as a percentage of GDP for each country.
@@ -42,9 +138,11 @@ class Model:
                                                                          / (df[self.col_merged['gdp_usd_trillions']]
                                                                             * 1000000) * 100)
 
-        return df[[self.col_merged['country'], self.countries_financial_summary_table['revenue_to_gdp']]]
+        return df[self.get_keys(self.col_merged['country']) + [self.countries_financial_summary_table['revenue_to_gdp']]]
 
 
+    @memoized
+    @instrumented()
     def get_real_interest_rate(self) -> pd.DataFrame:
         """
         Computes the real interest rate by subtracting inflation from the nominal interest rate.
@@ -56,9 +154,11 @@ class Model:
         df[self.countries_financial_summary_table['real_interest_rate']] = (df[self.col_merged['interest_rate']]
                                                                             - df[self.col_merged['inflation_rate']])
 
-        return df[[self.col_merged['country'], self.countries_financial_summary_table['real_interest_rate']]]
+        return df[self.get_keys(self.col_merged['country']) + [self.countries_financial_summary_table['real_interest_rate']]]
 
 
+    @memoized
+    @instrumented()
     def get_average_contribution_to_public_finances(self) -> pd.DataFrame:
         """
         Estimates each country's average contribution to public finances based on revenue and tax rate.
@@ -73,14 +173,18 @@ class Model:
                                                 df[self.col_merged['mean_revenue']]
                                                       / (df[self.col_merged['gdp_usd_trillions']] * 1000000)) * 100
 
-        return df[[self.col_merged['country'], self.countries_financial_summary_table['average_contrib_to_pub_fin']]]
+        return df[self.get_keys(self.col_merged['country'])
+                  + [self.countries_financial_summary_table['average_contrib_to_pub_fin']]]
 
 
+    @memoized
+    @instrumented()
     def get_average_roa_per_country(self) -> pd.DataFrame:
         """
         Computes the average Return on Assets (ROA) per country.
 
         This function filters out extreme values (5th and 95th percentiles) for better reliability.
+        In panel mode, the ROA is computed per country and year and the percentiles per year.
         :return: DataFrame with country names and their average ROA values.
         """
 
@@ -91,22 +195,25 @@ class Model:
                          result=self.countries_financial_summary_table['average_roa'], x=100)
 
         # Filter extreme outliers using 5th and 95th percentiles
-        q1 = df[self.countries_financial_summary_table['average_roa']].quantile(0.05)
-        q2 = df[self.countries_financial_summary_table['average_roa']].quantile(0.95)
-        df = df[(df[self.countries_financial_summary_table['average_roa']] >= q1) & (
-                df[self.countries_financial_summary_table['average_roa']] <= q2)]
+        roa = df[self.countries_financial_summary_table['average_roa']].to_numpy(dtype='float64')
+        df = df[self.get_percentile_mask(roa, df[self.year].to_numpy() if self.year else None)]
 
-        return df[[self.col_merged['country'], self.countries_financial_summary_table['average_roa']]]
+        return df[self.get_keys(self.col_merged['country']) + [self.countries_financial_summary_table['average_roa']]]
 
 
+    @memoized
+    @instrumented()
     def get_firms_financial_summary(self) -> pd.DataFrame:
         """
         Computes financial efficiency metrics for individual companies.
 
-        Includes Return on Assets and Revenue-to-Asset ratios.
+        Includes Return on Assets and Revenue-to-Asset ratios, per year in panel mode.
         :return: DataFrame with companies, ROA, and asset efficiency.
         """
 
+        if self.repo.backend == 'sqlite':
+            return self.repo.get_summary('firms_summary_stat')
+
         df = self.repo.largest_companies.copy()
 
         # Efficiency = Revenue / Assets
@@ -117,53 +224,199 @@ class Model:
         df = compute_ratio(df=df, num=self.col['net_income_usd_millions'], denom=self.col['total_asset_usd_millions'],
                           result=self.firms_financial_summary_table['return_on_assets'], x=100)
 
-        df = df[[self.col['company'], self.firms_financial_summary_table['asset_efficiency'],
-                 self.firms_financial_summary_table['return_on_assets']]].round(3)
+        df = df[self.get_keys(self.col['company']) + [self.firms_financial_summary_table['asset_efficiency'],
+                                                      self.firms_financial_summary_table['return_on_assets']]].round(3)
 
         return  df
 
 
+    @memoized
+    @instrumented()
     def get_country_financial_summary(self) -> pd.DataFrame:
         """
         Aggregates all country-level metrics into a single DataFrame.
 
-        Merges revenue-to-GDP, real interest rate, public finance contribution, and ROA.
+        Computes revenue-to-GDP, real interest rate, public finance contribution and ROA in a single
+        pass over the merged data, on NumPy arrays, with the same formulas as the individual getters.
+        Countries whose ROA falls outside the 5th-95th percentiles are removed with one mask.
+        In panel mode, there is one row per country and year, and the percentiles are computed per year.
         :return: Final country-level DataFrame containing financial summaries.
         """
 
-        df2 = self.get_revenue_to_gdp()
-        df3 = self.get_real_interest_rate()
-        df4 = self.get_average_contribution_to_public_finances()
-        df5 = self.get_average_roa_per_country()
+        if self.repo.backend == 'sqlite':
+            return self.repo.get_summary('financial_summary_stat')
+
+        df = self.repo.merged_data
+        summary = self.countries_financial_summary_table
+
+        def column(name: str) -> np.ndarray:
+            return df[self.col_merged[name]].to_numpy(dtype='float64')
+
+        mean_revenue = column('mean_revenue')
+
+        # GDP is in trillions -> convert to millions once for both ratios
+        gdp_millions = column('gdp_usd_trillions') * 1000000
 
-        # Merge datasets step-by-step on the country column
-        df = df2.merge(df3, on=self.col_merged['country'])
-        df = df.merge(df4, on=self.col_merged['country'])
-        df = df.merge(df5, on=self.col_merged['country'])
+        roa = column('mean_net_income') / column('mean_total_asset') * 100
+
+        # Filter extreme outliers using 5th and 95th percentiles
+        years = df[self.year].to_numpy() if self.year else None
+        mask = self.get_percentile_mask(roa, years)
+
+        df = pd.DataFrame({
+            self.col_merged['country']: df[self.col_merged['country']].to_numpy()[mask],
+            **({self.year: years[mask]} if self.year else {}),
+            summary['revenue_to_gdp']: (mean_revenue / gdp_millions * 100)[mask],
+            summary['real_interest_rate']: (column('interest_rate') - column('inflation_rate'))[mask],
+            summary['average_contrib_to_pub_fin']: ((column('corporate_tax_rate') / 100) * mean_revenue
+                                                    / gdp_millions * 100)[mask],
+            summary['average_roa']: roa[mask],
+        })
 
         df = df.round(3)
 
         return df
 
 
-    def export_datasets_to_sqlite(self, database_path: str) -> None:
+    @memoized
+    @instrumented()
+    def get_top_firms_by_roa(self, n: int) -> pd.DataFrame:
         """
-        Exports the summarized country and firm financial datasets to a SQLite database.
+        Ranks the firms by Return on Assets, using the firms index.
+
+        :param n: the number of firms kept.
+        :return: DataFrame with the `n` companies with the highest ROA, and their asset efficiency.
+        """
+
+        df = self.get_firms_financial_summary()
 
-        The data is saved under table names specified in the configuration file.
+        return df.iloc[self.get_firms_index().top(self.firms_financial_summary_table['return_on_assets'], n)]
+
+
+    @memoized
+    @instrumented()
+    def get_correlation(self, dataset: str = 'country_summary', method: str = 'pearson') -> pd.DataFrame:
+        """
+        Computes the correlation matrix between the numeric columns of a dataset.
+
+        The matrix is computed with NumPy on a float array; missing values (such as the zeros removed
+        by the ETL) are handled pairwise, each coefficient using the rows where both columns are known.
+        :param dataset: 'country_summary' for the country-level metrics, or 'merged' for the company
+                        means and every macroeconomic indicator of the merged dataset.
+        :param method: 'pearson', or 'spearman' for the rank correlation.
+        :return: DataFrame indexed and labelled by the columns.
         """
 
+        if dataset == 'country_summary':
+            df = self.get_country_financial_summary()
+        elif dataset == 'merged':
+            df = self.repo.merged_data
+        else:
+            raise ValueError(f"Unsupported dataset {dataset}")
+
+        columns = [column for column in df.select_dtypes('number').columns if column != self.year]
+        corr = get_correlation_matrix(df[columns].to_numpy(dtype='float64'), method=method)
+
+        return pd.DataFrame(corr, index=columns, columns=columns)
+
+
+    def get_macro_correlation(self) -> pd.DataFrame:
+        """
+        Computes the correlation matrix between the country-level metrics, with the method set in
+        the configuration of the heatmap.
+        :return: DataFrame indexed and labelled by the metrics of the country financial summary.
+        """
+
+        return self.get_correlation('country_summary', self.config['plot_macro_correlation_heatmap']['method'])
+
+
+    @memoized
+    @instrumented(rows=lambda model, index: len(index))
+    def get_firms_index(self) -> FirmIndex:
+        """
+        Indexes the firms summary on asset efficiency and ROA, for the top-N and threshold queries.
+        :return: the index, whose positions refer to the rows of `get_firms_financial_summary()`.
+        """
+
+        return FirmIndex(self.get_firms_financial_summary(), [self.firms_financial_summary_table['asset_efficiency'],
+                                                              self.firms_financial_summary_table['return_on_assets']])
+
+
+    def get_filtered_firms_summary(self, max_asset_efficiency: float, max_return_on_assets: float) -> pd.DataFrame:
+        """
+        Returns the firms whose asset efficiency and ROA are below the given thresholds.
+
+        With the SQLite repository the filter is run by the database on indexed columns, unless the
+        summary was loaded with the data, otherwise by the firms index, without scanning the whole
+        summary. A loaded summary is never read again from the database, which a later export rewrites.
+        :param max_asset_efficiency: the highest asset efficiency kept.
+        :param max_return_on_assets: the highest ROA kept.
+        :return: DataFrame with companies, ROA, and asset efficiency.
+        """
+
+        if self.repo.backend == 'sqlite' and 'firms_summary_stat' not in self.repo.summaries:
+            return self.repo.get_filtered_firms_summary(max_asset_efficiency, max_return_on_assets)
+
+        positions = self.get_firms_index().filter_at_most({
+            self.firms_financial_summary_table['asset_efficiency']: max_asset_efficiency,
+            self.firms_financial_summary_table['return_on_assets']: max_return_on_assets,
+        })
+
+        return self.get_firms_financial_summary().iloc[positions]
+
+
+    @instrumented()
+    def export_datasets_to_sqlite(self, database_path: str) -> bool:
+        """
+        Exports the summarized country and firm financial datasets to a SQLite database,
+        along with the repository datasets they are computed from, the top firms by ROA and
+        the correlation matrix of the country metrics, so the View can display them as they are.
+
+        The data is saved under table names specified in the configuration file,
+        and the columns listed in the configuration are indexed. All tables are bulk written
+        and swapped in a single transaction, through the process-wide engine of the database.
+
+        In upsert mode, the two summary tables are instead updated in place on their key, in the
+        same transaction as the other tables: only changed rows are written, stamped with the version of this export, and the rows no longer
+        exported are flagged as deleted. The export fails if a key is shared by several rows.
+        :return: True if the export succeeded.
+        """
+
+        # SQLAlchemy is only needed by the export, not to display the dashboard
+        from database import get_engine, write_tables, upsert_tables
+
+        export = self.config['export_final_results']
+
         try:
             country_financial_summary = self.get_country_financial_summary()
             firms_financial_summary = self.get_firms_financial_summary()
 
-            engine = create_engine(f'sqlite:///{database_path}', echo=True)
-
-            # Save both summaries to named tables defined in the config
-            country_financial_summary.to_sql(self.config['export_final_results']['financial_summary_stat'],
-                      con=engine, if_exists='replace', index=False)
-            firms_financial_summary.to_sql(self.config['export_final_results']['firms_summary_stat'],
-                      con=engine, if_exists='replace', index=False)
+            tables = {
+                export['financial_summary_stat']: country_financial_summary,
+                export['firms_summary_stat']: firms_financial_summary,
+                export['merged_table']: self.repo.merged_data,
+                export['largest_companies']: self.repo.largest_companies,
+                export['top_roa']: self.get_top_firms_by_roa(export['top_roa_size']),
+                export['macro_correlation']: self.get_macro_correlation().rename_axis('indicator').reset_index(),
+            }
+
+            # The upserted summaries and the other tables are committed together
+            with get_engine(database_path).begin() as connection:
+                if export['mode'] == 'upsert' and self.year:
+                    # The summaries have one row per key and year, which the upsert key cannot express
+                    logging.warning('upsert mode is not available in panel mode, the summaries are replaced')
+                elif export['mode'] == 'upsert':
+                    summaries = {table: tables.pop(table) for table in export['keys']}
+                    version = upsert_tables(connection, summaries, keys=export['keys'], indexes=export['indexes'],
+                                            chunksize=export['chunksize'], version_column=export['version_column'],
+                                            versions_table=export['versions_table'],
+                                            deleted_column=export['deleted_column'])
+                    logging.info(f'summaries upserted as version {version}')
+
+                # Save the summaries and datasets to named tables defined in the config
+                write_tables(connection, tables, indexes=export['indexes'], chunksize=export['chunksize'])
         except Exception as e:
             print(f'Error during the export, {e}')
+            return False
 
+        return True
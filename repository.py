@@ -1,63 +1,256 @@
 import os.path
+import sqlite3
 import pandas as pd
 
-from constants import config_file, output_path
-from helpers import get_serialized_data
+from contextlib import closing
+from constants import output_path, database_path
+from helpers import get_output_path, read_frame, read_partitions, get_schema
+from configuration import get_config
 
 
-def get_config():
-    """
-    Load and return the project configuration from the config file.
-    :return: Dictionary with configuration data.
-    """
-
-    # Create the absolute path to the config file
-    config_full_path = os.path.join(os.getcwd(), config_file)
-    return get_serialized_data(config_full_path)
-
 class Repository:
     """
-    Handles loading data either from CSV files or (optionally) a database.
+    Handles loading data either from the ETL output files or from the SQLite database.
 
     This class centralizes the logic to retrieve the project's data.
     """
 
-    def __init__(self, config: dict, output_path: str = None) -> None:
+    def __init__(self, config: dict, output_path: str = None, columns: dict = None, backend: str = None,
+                 database_path: str = database_path) -> None:
         """
         Initialize the Repository with the configuration and data source paths.
 
         :param config: Configuration dictionary.
-        :param output_path: Path to the folder where CSV files are stored.
+        :param output_path: Path to the folder where the ETL output files are stored.
+        :param columns: Optional mapping of 'merged_table' / 'largest_companies' to the only columns to load.
+        :param backend: 'files' or 'sqlite', defaults to the backend set in the configuration.
+        :param database_path: Path to the SQLite database used by the sqlite backend.
         """
 
         self.config = config
         self.output_path = output_path
+        self.columns = columns or {}
+        self.backend = backend or self.config['repository']['backend']
+        self.database_path = database_path
 
         # These attributes will hold the loaded datasets
         self.merged_data = None
         self.largest_companies = None
 
+        # Summary tables materialized in the database, see `get_summaries`
+        self.summaries = {}
+
+        # Incremented each time the datasets are (re)loaded, so dependent caches can be invalidated
+        self.version = 0
+
     def get_data(self) -> None:
         """
-        Load datasets from CSV files defined in the configuration.
+        Load datasets from the files written by the ETL, in the format defined in the configuration,
+        or from the SQLite database with the sqlite backend.
 
         This method fills `self.merged_data` and `self.largest_companies`
-        with DataFrames read from the specified CSV files.
+        with DataFrames read from the output files, keeping only the requested columns.
+        :return: none
+        """
+
+        # The summaries of the previous data are no longer valid
+        self.summaries = {}
+
+        if self.backend == 'sqlite':
+            self.get_data_from_sqlite()
+            self.version += 1
+            return
+
+        output_files = self.config['output_files_csv']
+        output_format = output_files['format']
+        schema = get_schema(self.config)
+
+        if self.config['panel']['enabled']:
+            self.get_data_from_partitions(schema)
+            self.version += 1
+            return
+
+        # Construct full paths to the output files
+        merged_file = get_output_path(self.output_path, output_files['merged_table'], output_format)
+        largest_file = get_output_path(self.output_path, output_files['largest_companies'], output_format)
+
+        # Read the files into pandas DataFrames, with the dtypes declared in the configuration
+        self.merged_data = read_frame(merged_file, output_format, schema['merged_table'],
+                                      columns=self.columns.get('merged_table'),
+                                      memory_map=output_files['memory_map'], engine=schema['csv_engine'])
+        self.largest_companies = read_frame(largest_file, output_format, schema['largest_companies_output'],
+                                            columns=self.columns.get('largest_companies'),
+                                            memory_map=output_files['memory_map'], engine=schema['csv_engine'])
+
+        self.version += 1
+
+    def get_data_from_partitions(self, schema: dict) -> None:
+        """
+        Load `self.merged_data` and `self.largest_companies` from the yearly partitions written
+        by the ETL in panel mode.
+
+        :param schema: the schema of the datasets, with the year column.
         :return: none
         """
 
-        # Construct full paths to the CSV files
-        merged_file = os.path.join(self.output_path, self.config['output_files_csv']['merged_table'])
-        largest_file = os.path.join(self.output_path, self.config['output_files_csv']['largest_companies'])
+        output_files = self.config['output_files_csv']
+
+        self.merged_data = read_partitions(self.output_path, output_files['merged_table'], output_files['format'],
+                                           schema['merged_table'], columns=self.columns.get('merged_table'),
+                                           memory_map=output_files['memory_map'], engine=schema['csv_engine'])
+        self.largest_companies = read_partitions(self.output_path, output_files['largest_companies'],
+                                                 output_files['format'], schema['largest_companies_output'],
+                                                 columns=self.columns.get('largest_companies'),
+                                                 memory_map=output_files['memory_map'], engine=schema['csv_engine'])
+
+    def get_data_from_sqlite(self) -> None:
+        """
+        Load `self.merged_data` and `self.largest_companies` from the tables exported by the Model.
+        :return: none
+        """
+
+        export = self.config['export_final_results']
+        schema = get_schema(self.config)
+
+        self.merged_data = self.read_table(export['merged_table'], self.columns.get('merged_table'),
+                                           schema['merged_table'])
+        self.largest_companies = self.read_table(export['largest_companies'], self.columns.get('largest_companies'),
+                                                 schema['largest_companies_output'])
+
+    def get_summary_table(self, table: str) -> pd.DataFrame:
+        """
+        Read a summary table precomputed by `Model.export_datasets_to_sqlite`.
+
+        :param table: the name of the table.
+        :return: the summary DataFrame.
+        """
+
+        return self.get_live_rows(self.read_table(table))
+
+    def get_summary(self, name: str) -> pd.DataFrame:
+        """
+        Return a summary loaded by `get_summaries`, or read it from the database when it was not loaded.
+
+        :param name: the key of the summary table in the export_final_results section of the configuration.
+        :return: the summary DataFrame.
+        """
+
+        if name in self.summaries:
+            return self.summaries[name]
+
+        return self.get_summary_table(self.config['export_final_results'][name])
+
+    def get_live_rows(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Drop the tombstones and the version columns of an upserted summary table.
+
+        :param df: rows read from a summary table, replaced or upserted.
+        :return: the rows still exported, with the columns of the summary.
+        """
+
+        export = self.config['export_final_results']
+
+        if export['deleted_column'] in df.columns:
+            df = df[df[export['deleted_column']] == 0].reset_index(drop=True)
+
+        return df.drop(columns=[export['version_column'], export['deleted_column']], errors='ignore')
+
+    def get_summaries(self) -> None:
+        """
+        Load the summaries materialized by `Model.export_datasets_to_sqlite` into `self.summaries`,
+        keyed as in the export_final_results section of the configuration, so the View can serve
+        them without recomputing. Tables missing from the database are skipped.
+        :return: none
+        """
+
+        export = self.config['export_final_results']
+        self.summaries = {}
+
+        if not os.path.exists(self.database_path):
+            return
+
+        with closing(sqlite3.connect(f'file:{self.database_path}?mode=ro', uri=True)) as connection:
+            tables = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+        for name in ('financial_summary_stat', 'firms_summary_stat', 'top_roa', 'macro_correlation'):
+            if export[name] in tables:
+                self.summaries[name] = self.get_summary_table(export[name])
+
+        # The correlation matrix is stored with its index as first column
+        if 'macro_correlation' in self.summaries:
+            df = self.summaries['macro_correlation']
+            self.summaries['macro_correlation'] = df.set_index(df.columns[0]).rename_axis(None)
+
+    def get_latest_version(self) -> int:
+        """
+        Return the version of the latest upsert export, or 0 if there was none.
+        :return: the version number.
+        """
+
+        versions_table = self.config['export_final_results']['versions_table']
+
+        with closing(sqlite3.connect(f'file:{self.database_path}?mode=ro', uri=True)) as connection:
+            if not connection.execute('SELECT 1 FROM sqlite_master WHERE name = ?', (versions_table,)).fetchone():
+                return 0
+            return connection.execute(f'SELECT COALESCE(MAX(version), 0) FROM "{versions_table}"').fetchone()[0]
+
+    def get_changes_since(self, table: str, version: int) -> pd.DataFrame:
+        """
+        Read the rows of an upserted summary table that changed after a given export version.
+
+        :param table: the name of the summary table.
+        :param version: the last version already known by the caller.
+        :return: the new, updated and deleted rows, with the version that last changed them and
+                 the deleted flag, 1 for the rows no longer exported.
+        """
+
+        version_column = self.config['export_final_results']['version_column']
+
+        return self.read_table(table, where=f'WHERE "{version_column}" > ?', params=(version,))
+
+    def get_filtered_firms_summary(self, max_asset_efficiency: float, max_return_on_assets: float) -> pd.DataFrame:
+        """
+        Query the firms summary table for the firms below both thresholds, using the column indexes.
+
+        :param max_asset_efficiency: the highest asset efficiency kept.
+        :param max_return_on_assets: the highest ROA kept.
+        :return: the filtered firms summary.
+        """
+
+        firms = self.config['firms_financial_summary_table']
+
+        df = self.read_table(self.config['export_final_results']['firms_summary_stat'],
+                             where=f'WHERE "{firms["asset_efficiency"]}" <= ? AND "{firms["return_on_assets"]}" <= ?',
+                             params=(max_asset_efficiency, max_return_on_assets))
+
+        return self.get_live_rows(df)
+
+    def read_table(self, table: str, columns: list = None, schema: dict = None, where: str = '',
+                   params: tuple = ()) -> pd.DataFrame:
+        """
+        Run a SELECT on a table of the SQLite database, opened read-only.
+
+        :param table: the name of the table.
+        :param columns: the columns to select, or None for all of them.
+        :param schema: optional mapping of column names to dtypes applied to the result.
+        :param where: optional WHERE clause, with ? placeholders.
+        :param params: the values of the placeholders.
+        :return: the query result.
+        """
+
+        select = ', '.join(f'"{column}"' for column in columns) if columns else '*'
+
+        with closing(sqlite3.connect(f'file:{self.database_path}?mode=ro', uri=True)) as connection:
+            df = pd.read_sql_query(f'SELECT {select} FROM "{table}" {where}', connection, params=params)
+
+        if schema:
+            df = df.astype({column: dtype for column, dtype in schema.items() if column in df.columns})
 
-        # Read the CSV files into pandas DataFrames
-        self.merged_data = pd.read_csv(merged_file, sep=',') #separated by columns
-        self.largest_companies = pd.read_csv(largest_file,sep =',')
+        return df
 
 if __name__ == '__main__':
     # Load the configuration and initialize the repository
-    config_path = os.path.join(os.getcwd(), config_file)
-    config = get_serialized_data(config_path)
+    config = get_config()
     repo = Repository(config, output_path)
     repo.get_data()
 
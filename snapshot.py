@@ -0,0 +1,181 @@
+"""
+This module builds the versioned data snapshots the dashboard starts from.
+
+A snapshot is a self-contained SQLite database holding the datasets and the summaries displayed by
+the View, written by running the ETL and the Model export once, outside of the Streamlit app.
+Snapshots are never modified: each build writes a new file named after its version, then replaces
+the current snapshot file pointing at it, so a running dashboard never reads a half-written snapshot.
+
+Usage:
+    python snapshot.py           # build a new snapshot if the inputs or the configuration changed
+    python snapshot.py --force   # always build a new snapshot
+"""
+
+import os
+import sys
+import json
+import glob
+import time
+import sqlite3
+import logging
+import argparse
+
+from contextlib import closing
+from constants import input_dir, config_file
+from helpers import get_files_hash
+from logger import Logger
+from configuration import get_config
+from repository import Repository
+from instrumentation import configure as configure_instrumentation
+
+
+def get_snapshot_folder(config: dict) -> str:
+    """
+    Return the folder of the snapshots.
+
+    :param config: the project configuration.
+    :return: the folder path, in the output folder.
+    """
+
+    return os.path.join(config['folders']['output_folder'], config['snapshot']['folder'])
+
+
+def get_current_snapshot(config: dict) -> dict:
+    """
+    Read the description of the current snapshot.
+
+    :param config: the project configuration.
+    :return: the version, inputs hash, creation time, file name and path of the snapshot,
+             or None if no complete snapshot exists.
+    """
+
+    folder = get_snapshot_folder(config)
+    current_path = os.path.join(folder, config['snapshot']['current_file'])
+
+    if not os.path.exists(current_path):
+        return None
+
+    with open(current_path, mode='r', encoding='utf-8') as file:
+        snapshot = json.load(file)
+
+    snapshot['path'] = os.path.join(folder, snapshot['file'])
+
+    return snapshot if os.path.exists(snapshot['path']) else None
+
+
+def build_snapshot(config: dict, force: bool = False, input_folder: str = input_dir,
+                   config_path: str = config_file) -> dict:
+    """
+    Run the ETL and export its results to a new snapshot, then make it the current one.
+
+    Nothing is done when the current snapshot was built from the same input files and configuration.
+    :param config: the project configuration.
+    :param force: build a new snapshot even if the current one is up to date.
+    :param input_folder: the folder of the input files.
+    :param config_path: the configuration file, hashed with the input files.
+    :return: the description of the current snapshot, or None if the export failed.
+    """
+
+    from etl import Etl
+    from model import Model
+    from database import dispose_engine
+
+    etl = Etl(config=config, input_dir=input_folder)
+    inputs_hash = get_files_hash([config_path] + etl.get_input_paths())
+
+    current = get_current_snapshot(config)
+    if current is not None and current['inputs_hash'] == inputs_hash and not force:
+        logging.info(f'snapshot {current["version"]} is up to date')
+        return current
+
+    etl.run()
+
+    # The snapshot is made of the files just written by the ETL, whatever backend the dashboard reads
+    repo = Repository(config, config['folders']['output_folder'], columns=Model.get_required_columns(config),
+                      backend='files')
+    repo.get_data()
+    model = Model(config, repo)
+
+    folder = get_snapshot_folder(config)
+    os.makedirs(folder, exist_ok=True)
+
+    version = f'{time.strftime("%Y%m%dT%H%M%S")}-{inputs_hash[:12]}'
+    snapshot_path = os.path.join(folder, f'snapshot_{version}.sqlite')
+    building_path = f'{snapshot_path}.building'
+
+    exported = model.export_datasets_to_sqlite(building_path)
+
+    dispose_engine(building_path)
+
+    if not exported:
+        for path in glob.glob(f'{building_path}*'):
+            os.remove(path)
+        return None
+
+    # Fold the write-ahead log into the database, so the snapshot is a single read-only file
+    with closing(sqlite3.connect(building_path)) as connection:
+        connection.execute('PRAGMA journal_mode=DELETE')
+    os.replace(building_path, snapshot_path)
+
+    snapshot = {
+        'version': version,
+        'inputs_hash': inputs_hash,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'file': os.path.basename(snapshot_path),
+    }
+
+    # Written next to the final file then renamed, readers see either the old or the new snapshot
+    current_path = os.path.join(folder, config['snapshot']['current_file'])
+    with open(f'{current_path}.tmp', mode='w', encoding='utf-8') as file:
+        json.dump(snapshot, file, indent=2)
+    os.replace(f'{current_path}.tmp', current_path)
+
+    logging.info(f'snapshot {version} written to {snapshot_path}')
+    remove_old_snapshots(config, snapshot['file'])
+
+    return {**snapshot, 'path': snapshot_path}
+
+
+def remove_old_snapshots(config: dict, current_file: str) -> None:
+    """
+    Delete the oldest snapshots, keeping the number set in the configuration.
+
+    :param config: the project configuration.
+    :param current_file: the file name of the current snapshot, never deleted.
+    :return: none
+    """
+
+    # The version starts with the build time, so the names sort chronologically
+    paths = sorted(glob.glob(os.path.join(get_snapshot_folder(config), 'snapshot_*.sqlite')), reverse=True)
+    kept = max(config['snapshot']['keep'], 1)
+
+    for path in paths[kept:]:
+        if os.path.basename(path) != current_file:
+            os.remove(path)
+
+
+def main() -> int:
+    """
+    Build a snapshot from the command line.
+    :return: the exit code, 1 if the snapshot could not be built.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--force', action='store_true', help='build a new snapshot even if it is up to date')
+    args = parser.parse_args()
+
+    config = get_config()
+    Logger(config).set_log()
+    configure_instrumentation(config)
+
+    snapshot = build_snapshot(config, force=args.force)
+    if snapshot is None:
+        print('[Error] the snapshot could not be built')
+        return 1
+
+    print(f'current snapshot: {snapshot["version"]} ({snapshot["path"]})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
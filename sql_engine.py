@@ -0,0 +1,190 @@
+"""
+This module runs the clean, aggregate and merge steps of the ETL as SQL queries, on DuckDB or on
+an embedded SQLite database, so that inputs larger than the memory can be processed.
+
+The queries reproduce the pandas steps of `Etl`: zeros are replaced by NULL in the numeric columns,
+rows where every value is NULL are dropped, duplicated rows are dropped keeping the first one, the
+companies are averaged per country and joined with the financial indicators.
+"""
+
+import importlib.util
+import pandas as pd
+
+# SQL type of each dtype of the configuration schema, for DuckDB's CSV reader
+SQL_TYPES = {'float64': 'DOUBLE', 'float32': 'FLOAT', 'int64': 'BIGINT', 'int32': 'INTEGER',
+             'Int64': 'BIGINT', 'Int32': 'INTEGER',
+             'category': 'VARCHAR', 'object': 'VARCHAR', 'string': 'VARCHAR', 'string[pyarrow]': 'VARCHAR'}
+
+# Strings read as missing values, as pandas does by default
+NULL_STRINGS = ['', 'NA', 'N/A', 'NaN', 'nan', 'NULL', 'null']
+
+
+def is_duckdb_available() -> bool:
+    """
+    Check whether DuckDB is installed, without importing it.
+    :return: True if DuckDB can be imported.
+    """
+
+    return importlib.util.find_spec('duckdb') is not None
+
+
+def connect_duckdb(temp_directory: str):
+    """
+    Open an in-memory DuckDB database which spills to `temp_directory` when the memory is exhausted.
+
+    :param temp_directory: the folder of the temporary files.
+    :return: the DuckDB connection.
+    """
+
+    import duckdb
+
+    connection = duckdb.connect()
+    connection.execute(f"SET temp_directory = {quote_literal(temp_directory)}")
+    # Needed to keep the first of the duplicated rows, as pandas does
+    connection.execute('SET preserve_insertion_order = true')
+
+    return connection
+
+
+def quote_literal(value: str) -> str:
+    """
+    Quote a string literal for SQL.
+
+    :param value: the string.
+    :return: the quoted literal.
+    """
+
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Quote a column or table name for SQL.
+
+    :param name: the name.
+    :return: the quoted identifier.
+    """
+
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def get_duckdb_source(path: str, schema: dict) -> str:
+    """
+    Build the relation reading a CSV file with DuckDB, numbering its rows in file order.
+
+    :param path: the CSV file path.
+    :param schema: the dtypes of the raw columns.
+    :return: a subquery with the raw columns and a `rowid` column.
+    """
+
+    columns = ', '.join(f'{quote_literal(column)}: {quote_literal(SQL_TYPES[str(dtype)])}'
+                        for column, dtype in schema.items())
+    null_strings = ', '.join(quote_literal(value) for value in NULL_STRINGS)
+
+    return (f'(SELECT *, row_number() OVER () AS rowid FROM read_csv({quote_literal(path)}, header = true, '
+            f'columns = {{{columns}}}, nullstr = [{null_strings}]))')
+
+
+def stage_frames(connection, table: str, frames) -> str:
+    """
+    Load dataframes, e.g. the chunks of a CSV file, into a table of a SQLite database.
+
+    :param connection: the sqlite3 connection.
+    :param table: the name of the table, replaced if it exists.
+    :param frames: an iterable of dataframes with the same columns.
+    :return: the quoted table name, whose implicit `rowid` numbers the rows in load order.
+    """
+
+    connection.execute(f'DROP TABLE IF EXISTS {quote_identifier(table)}')
+
+    for df in frames:
+        df.to_sql(table, con=connection, index=False, if_exists='append')
+
+    connection.commit()
+
+    return quote_identifier(table)
+
+
+def get_clean_query(source: str, columns: dict, numeric_columns: list) -> str:
+    """
+    Build the query cleaning a raw relation like `Etl.clean_frame`.
+
+    :param source: the raw relation, with a `rowid` column giving the row order.
+    :param columns: mapping of the raw column names to the clean ones, in output order.
+    :param numeric_columns: the raw columns where zeros are missing values.
+    :return: the query returning the clean columns and a `row_order` column.
+    """
+
+    expressions = [f'NULLIF({quote_identifier(raw)}, 0)' if raw in numeric_columns else quote_identifier(raw)
+                   for raw in columns]
+    selected = ', '.join(f'{expression} AS {quote_identifier(clean)}'
+                         for expression, clean in zip(expressions, columns.values()))
+    all_missing = ' AND '.join(f'{expression} IS NULL' for expression in expressions)
+
+    # Grouping on every column keeps one row per distinct row, the first one in file order
+    return (f'SELECT {selected}, MIN(rowid) AS row_order FROM {source} '
+            f'WHERE NOT ({all_missing}) '
+            f'GROUP BY {", ".join(expressions)}')
+
+
+def get_merge_query(companies: str, indicators: str, key: str, mean_columns: list, indicator_columns: list) -> str:
+    """
+    Build the query averaging the clean companies per country and joining the financial indicators,
+    like `Etl.aggregate_data` and `Etl.merge_data`.
+
+    :param companies: the clean company relation.
+    :param indicators: the clean financial indicators relation.
+    :param key: the country column of both relations.
+    :param mean_columns: the company columns averaged per country.
+    :param indicator_columns: the financial indicator columns, other than the key.
+    :return: the query, with the key, the means and the indicators, named as in the input relations,
+             ordered by key like the groups of pandas.
+    """
+
+    means = ', '.join(f'AVG({quote_identifier(column)}) AS {quote_identifier(column)}' for column in mean_columns)
+    selected = ', '.join([f'a.{quote_identifier(key)}']
+                         + [f'a.{quote_identifier(column)}' for column in mean_columns]
+                         + [f'i.{quote_identifier(column)}' for column in indicator_columns])
+
+    return (f'SELECT {selected} '
+            f'FROM (SELECT {quote_identifier(key)}, {means} FROM {companies} '
+            f'GROUP BY {quote_identifier(key)}) AS a '
+            f'INNER JOIN {indicators} AS i ON a.{quote_identifier(key)} = i.{quote_identifier(key)} '
+            f'ORDER BY a.{quote_identifier(key)}')
+
+
+def iter_query(connection, query: str, chunksize: int):
+    """
+    Run a query and yield its result by dataframes of `chunksize` rows.
+
+    Works with sqlite3 and DuckDB connections.
+    :param connection: the database connection.
+    :param query: the query.
+    :param chunksize: the number of rows per dataframe.
+    :return: an iterator of dataframes.
+    """
+
+    cursor = connection.execute(query)
+    columns = [description[0] for description in cursor.description]
+
+    while True:
+        rows = cursor.fetchmany(chunksize)
+        if not rows:
+            break
+        yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+def cast_to_schema(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """
+    Cast a query result to the dtypes of the configuration schema.
+
+    Integer columns holding missing values are left as floats, as pandas does.
+    :param df: the query result.
+    :param schema: the dtypes of the columns.
+    :return: the cast dataframe.
+    """
+
+    dtypes = {column: dtype for column, dtype in schema.items()
+              if column in df.columns and not (str(dtype).startswith('int') and df[column].isna().any())}
+
+    return df.astype(dtypes)
@@ -0,0 +1,36 @@
+import os
+import sys
+import shutil
+
+import yaml
+import pytest
+
+# The project modules live at the root of the repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """
+    Copy the input folder and configuration of the project to a temporary folder and run the test
+    from there, so the outputs are written to the temporary folder.
+
+    :return: a function applying overrides to the configuration file, as {section: {key: value}}.
+    """
+
+    shutil.copytree(os.path.join(ROOT, 'input'), tmp_path / 'input')
+    monkeypatch.chdir(tmp_path)
+
+    def set_config(overrides: dict) -> None:
+        config_path = tmp_path / 'input' / 'config.yaml'
+        with open(config_path, encoding='utf-8') as file:
+            config = yaml.safe_load(file)
+
+        for section, values in overrides.items():
+            config[section].update(values)
+
+        with open(config_path, mode='w', encoding='utf-8') as file:
+            yaml.safe_dump(config, file, allow_unicode=True, sort_keys=False)
+
+    return set_config
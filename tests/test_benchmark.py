@@ -0,0 +1,46 @@
+import pandas as pd
+
+from benchmark import compare_with_baseline, get_previous_layout, measure
+from configuration import Config
+
+
+def get_results(seconds: list, peak_mb: list) -> pd.DataFrame:
+    return pd.DataFrame({'firms': 1000, 'countries': 20, 'stage': ['fast', 'slow'],
+                         'seconds': seconds, 'peak_mb': peak_mb})
+
+
+def test_compare_ignores_the_noise_of_fast_stages():
+    baseline = get_results([0.0005, 1.0], [1.0, 10.0])
+    results = get_results([0.0020, 1.1], [1.0, 10.0])
+
+    comparison = compare_with_baseline(results, baseline, tolerance=0.2, min_ms=5)
+
+    assert not comparison['regression'].any()
+
+
+def test_compare_flags_slower_stages_and_memory():
+    baseline = get_results([0.0005, 1.0], [1.0, 10.0])
+    results = get_results([0.0200, 1.5], [1.5, 10.0])
+
+    comparison = compare_with_baseline(results, baseline, tolerance=0.2, min_ms=5)
+
+    assert comparison['regression'].tolist() == [True, True]
+
+
+def test_measure_warms_up_and_repeats():
+    calls = []
+
+    median, fastest, peak = measure(lambda: calls.append(1), trace_memory=False, repeat=3, warmup=2)
+
+    assert len(calls) == 5
+    assert 0 <= fastest <= median
+    assert peak != peak
+
+
+def test_previous_layout_stores_every_text_column_as_objects(project):
+    config = get_previous_layout(Config('input/config.yaml'))
+
+    for name in ('largest_companies', 'largest_companies_output'):
+        dtypes = set(config['schema'][name].values())
+        assert 'object' in dtypes
+        assert not dtypes & {'category', 'string', 'string[pyarrow]'}
@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+from sqlalchemy import inspect
+
+from configuration import Config
+from database import get_engine, dispose_engine, upsert_tables, write_tables
+from repository import Repository
+
+KEYS = {'firms': 'company', 'countries': ['country', 'year']}
+
+
+@pytest.fixture
+def database(project, tmp_path):
+    path = str(tmp_path / 'upsert.sqlite')
+    yield path
+    dispose_engine(path)
+
+
+def upsert(path: str, tables: dict) -> int:
+    return upsert_tables(get_engine(path), tables, keys=KEYS)
+
+
+def test_removed_rows_are_versioned_tombstones(database):
+    repo = Repository(Config('input/config.yaml'), database_path=database)
+    firms = pd.DataFrame({'company': ['Alpha', 'Beta', 'Gamma'], 'return_on_assets': [1.0, 2.0, 3.0]})
+
+    first = upsert(database, {'firms': firms})
+    second = upsert(database, {'firms': firms[firms['company'] != 'Beta'].assign(return_on_assets=[1.0, 3.5])})
+
+    changes = repo.get_changes_since('firms', first)
+    assert changes.set_index('company')[['deleted', 'version']].to_dict(orient='index') == {
+        'Beta': {'deleted': 1, 'version': second}, 'Gamma': {'deleted': 0, 'version': second}}
+    assert repo.get_summary_table('firms')['company'].tolist() == ['Alpha', 'Gamma']
+
+    # An exported row again is no longer deleted
+    third = upsert(database, {'firms': firms})
+    changes = repo.get_changes_since('firms', second)
+    assert changes.set_index('company')[['deleted', 'version']].to_dict(orient='index') == {
+        'Beta': {'deleted': 0, 'version': third}, 'Gamma': {'deleted': 0, 'version': third}}
+    assert repo.get_summary_table('firms')['company'].tolist() == ['Alpha', 'Beta', 'Gamma']
+
+
+def test_composite_keys(database):
+    repo = Repository(Config('input/config.yaml'), database_path=database)
+    countries = pd.DataFrame({'country': ['France', 'France', 'Japan'], 'year': [2023, 2024, 2024],
+                              'roa': [1.0, 2.0, 3.0]})
+
+    first = upsert(database, {'countries': countries})
+    upsert(database, {'countries': countries.assign(roa=[1.0, 2.5, 3.0])})
+
+    changes = repo.get_changes_since('countries', first)
+    assert changes[['country', 'year', 'roa']].values.tolist() == [['France', 2024, 2.5]]
+
+
+def test_shared_keys_fail_without_writing(database):
+    firms = pd.DataFrame({'company': ['Alpha', 'Alpha'], 'return_on_assets': [1.0, 2.0]})
+
+    with pytest.raises(ValueError, match='sharing their key'):
+        upsert(database, {'firms': firms})
+
+    with pytest.raises(ValueError, match='without a value'):
+        upsert(database, {'firms': pd.DataFrame({'company': [None], 'return_on_assets': [1.0]})})
+
+    assert not inspect(get_engine(database)).has_table('firms')
+
+
+def test_failed_write_leaves_every_table_unchanged(database):
+    engine = get_engine(database)
+    write_tables(engine, {'firms': pd.DataFrame({'company': ['Alpha']})})
+
+    # Nothing is inserted before the second table fails: only DDL statements ran
+    tables = {'firms': pd.DataFrame({'company': pd.Series([], dtype='object')}),
+              'broken': pd.DataFrame({'company': [{'not': 'a value'}]})}
+    with pytest.raises(Exception):
+        write_tables(engine, tables)
+
+    with engine.connect() as connection:
+        assert pd.read_sql_table('firms', connection)['company'].tolist() == ['Alpha']
+    assert not inspect(engine).has_table('broken__staging')
+
+
+def test_upsert_and_write_share_a_transaction(database):
+    repo = Repository(Config('input/config.yaml'), database_path=database)
+    engine = get_engine(database)
+    firms = pd.DataFrame({'company': ['Alpha'], 'return_on_assets': [1.0]})
+    upsert(database, {'firms': firms})
+
+    with pytest.raises(Exception):
+        with engine.begin() as connection:
+            upsert_tables(connection, {'firms': firms.assign(return_on_assets=2.0)}, keys=KEYS)
+            write_tables(connection, {'broken': pd.DataFrame({'company': [{'not': 'a value'}]})})
+
+    assert repo.get_summary_table('firms')['return_on_assets'].tolist() == [1.0]
+    assert repo.get_latest_version() == 1
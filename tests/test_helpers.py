@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import helpers
+from helpers import get_cached_files_hash, get_files_hash, get_float32_columns, restore_float64
+
+
+def test_cents_are_stored_as_float32_and_restored():
+    df = pd.DataFrame({'revenue': [1891.48, 62809.0, np.nan, 0.01],
+                       'assets': [4715067.32, 106540.0, 32744.0, 1.0],
+                       'rank': [1.5, 2.0, 3.0, 4.0]})
+
+    # float32 cannot hold the cents of millions
+    assert get_float32_columns(df, ['revenue', 'assets'], decimals=2) == ['revenue']
+    assert get_float32_columns(df, ['revenue', 'assets'], decimals=None) == []
+
+    compact = df.astype({'revenue': 'float32'})
+    restored = restore_float64(compact, ['revenue', 'assets'], decimals=2)
+
+    pd.testing.assert_frame_equal(restored, df, check_exact=True)
+    assert compact['revenue'].dtype == 'float32'
+
+
+def test_restore_returns_frames_without_float32_columns_unchanged():
+    df = pd.DataFrame({'revenue': [1.25, 2.5]})
+
+    assert restore_float64(df, ['revenue'], decimals=2) is df
+
+
+def test_files_are_only_hashed_again_when_their_signature_changes(tmp_path, monkeypatch):
+    path = str(tmp_path / 'companies.csv')
+    with open(path, 'w') as file:
+        file.write('a,b\n1,2\n')
+
+    calls = []
+    monkeypatch.setattr(helpers, 'get_files_hash', lambda paths: calls.append(paths) or get_files_hash(paths))
+
+    first = get_cached_files_hash([path])
+    assert get_cached_files_hash([path]) == first
+    assert len(calls) == 1
+
+    with open(path, 'a') as file:
+        file.write('3,4\n')
+    os.utime(path, ns=(0, 0))
+
+    assert get_cached_files_hash([path]) != first
+    assert len(calls) == 2
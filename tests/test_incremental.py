@@ -0,0 +1,84 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from configuration import Config
+from etl import Etl
+from manifest import RowHashIndex
+
+
+@pytest.fixture
+def run(project):
+    project({'etl': {'incremental': True}})
+
+    def run_etl() -> pd.DataFrame:
+        """
+        Run the incremental ETL.
+
+        :return: the exported companies, with the number of rows processed in `attrs['new_rows']`.
+        """
+
+        config = Config('input/config.yaml')
+        etl = Etl(config=config, input_dir=config.input_folder)
+        etl.run()
+
+        df = pd.read_csv(etl.get_output_path('largest_companies'))
+        df.attrs['new_rows'] = len(etl.df_largest_companies)
+        return df
+
+    return run_etl
+
+
+def test_appended_rows_are_processed_alone(run):
+    companies = run()
+
+    with open('input/largest_companies.csv', mode='a', encoding='utf-8') as file:
+        file.write('51,Newco,Banking,100.5,2000.25,30.1,France\n')
+
+    updated = run()
+
+    assert updated.attrs['new_rows'] == 1
+    assert len(updated) == len(companies) + 1
+    assert updated['company'].iloc[-1] == 'Newco'
+
+
+def test_edited_rows_trigger_a_full_run(run):
+    # Far more than a few blocks of data after the edited row
+    with open('input/largest_companies.csv', mode='a', encoding='utf-8') as file:
+        file.writelines(f'{rank},Company {rank},Banking,100.5,2000.25,30.1,France\n' for rank in range(51, 5000))
+
+    companies = run()
+
+    # Same byte length, at the start of the file
+    with open('input/largest_companies.csv', encoding='utf-8') as file:
+        content = file.read()
+    with open('input/largest_companies.csv', mode='w', encoding='utf-8') as file:
+        file.write(content.replace('275788.0', '275789.0', 1))
+
+    updated = run()
+
+    assert updated.attrs['new_rows'] == len(companies)
+    assert updated.loc[0, 'revenue_usd_millions'] == 275789.0
+
+
+def test_row_hash_index_keeps_few_runs():
+    rng = np.random.default_rng(0)
+    index = RowHashIndex()
+    added = set()
+
+    for _ in range(200):
+        hashes = rng.integers(0, 50_000, size=100, dtype='uint64')
+        assert (index.contains(hashes) == np.isin(hashes, list(added))).all()
+        index.add(hashes)
+        added.update(hashes.tolist())
+
+    assert len(index) == len(added)
+    assert len(index.runs) <= np.log2(len(added)) + 1
+
+    # Manifests written with a single sorted array are still read
+    old = RowHashIndex.__new__(RowHashIndex)
+    old.__dict__['hashes'] = np.sort(np.array(list(added), dtype='uint64'))
+    restored = pickle.loads(pickle.dumps(old))
+    assert len(restored) == len(added) and restored.contains(old.hashes).all()
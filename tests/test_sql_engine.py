@@ -0,0 +1,86 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from configuration import Config
+from etl import Etl
+from helpers import read_frame
+from sql_engine import is_duckdb_available
+
+ENGINES = ['sqlite', pytest.param('duckdb', marks=pytest.mark.skipif(not is_duckdb_available(),
+                                                                      reason='duckdb is not installed'))]
+
+SYNTHETIC_COMPANIES = """Rank,Company,Industry,Revenue in (USD Million),Total Assest in (USD Millions),Net Income in (USD Millions),Headquarters
+1,Alpha Holdings,Banking,1200.5,30000.25,0,United States
+2,Beta Motors,Automotive,0,0,0,Germany
+3,Gamma Energy,Energy,800.75,,95.1,China
+0,Omega Bank,Banking,10.5,200.25,1.1,Germany
+,,,,,,
+,NoRank Co,Banking,100.5,2000.25,30.1,United States
+4,Delta Insurance,Insurance,450.2,12000.8,-35.6,Japan
+4,Delta Insurance,Insurance,450.2,12000.8,-35.6,Japan
+5,Epsilon Retail,Retail,,,,United States
+,,,0,0,0,
+6,Zeta Mining,Mining,300.33,4500.01,12.5,Atlantis
+"""
+
+SYNTHETIC_INDICATORS = """Country,Interest Rate (%),Inflation Rate (%),Banking Sector Assets (% of GDP),Stock Market Capitalization (% of GDP),Corporate Tax Rate (%),GDP (USD Trillions)
+United States,5.25,3.4,215,160,21.0,25.5
+Germany,0,6.9,0,45,29.9,4.1
+China,2.5,1.8,280,85,25.0,17.7
+,,,,,,
+Japan,-0.1,3.2,250,120,30.6,4.2
+Japan,-0.1,3.2,250,120,30.6,4.2
+"""
+
+
+@pytest.fixture(params=['shipped', 'synthetic'])
+def inputs(request, project, tmp_path):
+    """
+    The input folder of the ETL: the shipped inputs, or small files with zeros, empty rows and duplicates.
+    """
+
+    if request.param == 'synthetic':
+        (tmp_path / 'input' / 'largest_companies.csv').write_text(SYNTHETIC_COMPANIES, encoding='utf-8')
+        (tmp_path / 'input' / 'financial_indicators.csv').write_text(SYNTHETIC_INDICATORS, encoding='utf-8')
+
+    return project
+
+
+def run_etl(engine: str, output_format: str) -> dict:
+    """
+    Run the ETL with an engine in its own output folder.
+
+    :return: the merged and companies output files, read back as the repository does.
+    """
+
+    config = Config('input/config.yaml')
+    config['folders']['output_folder'] = f'output_{engine}'
+    config['etl']['engine'] = engine
+    # Small staging chunks, so the SQL engines go through several chunks
+    config['etl']['staging_chunksize'] = 3
+    config['output_files_csv']['format'] = output_format
+
+    etl = Etl(config=config, input_dir=config.input_folder)
+    etl.run()
+
+    outputs = {'merged_table': read_frame(etl.get_output_path('merged_table'), output_format,
+                                          etl.schema['merged_table']),
+               'largest_companies': read_frame(etl.get_output_path('largest_companies'), output_format,
+                                               etl.schema['largest_companies_output'])}
+    shutil.rmtree(config.output_folder)
+
+    return outputs
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+@pytest.mark.parametrize('engine', ENGINES)
+def test_sql_engine_matches_pandas(inputs, engine, output_format):
+    expected = run_etl('pandas', output_format)
+    outputs = run_etl(engine, output_format)
+
+    assert len(expected['merged_table']) > 0
+    for name in expected:
+        pd.testing.assert_frame_equal(outputs[name], expected[name], check_exact=True)
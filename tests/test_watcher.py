@@ -0,0 +1,83 @@
+import pytest
+import streamlit as st
+
+from configuration import get_config
+from watcher import InputWatcher, LiveData
+
+
+def append_company(path: str, name: str) -> None:
+    """
+    Append a copy of the first company of a company file under another name.
+    """
+
+    with open(path, encoding='utf-8') as file:
+        lines = file.read().splitlines()
+
+    first = lines[1].split(',')
+    first[1] = name
+
+    with open(path, mode='a', encoding='utf-8') as file:
+        file.write(','.join(first) + '\n')
+
+
+def test_check_waits_for_the_writes_to_stop(project, tmp_path):
+    path = tmp_path / 'input' / 'largest_companies.csv'
+    watcher = InputWatcher(lambda: [str(path)], None, poll_interval=1, debounce=5)
+
+    assert not watcher.check(now=0)
+
+    append_company(str(path), 'Newco 1')
+    assert not watcher.check(now=1)
+    assert not watcher.check(now=3)
+
+    # A new write restarts the delay
+    append_company(str(path), 'Newco 2')
+    assert not watcher.check(now=4)
+    assert not watcher.check(now=8)
+    assert watcher.check(now=9.5)
+
+    assert not watcher.check(now=20)
+
+
+def get_companies(model) -> set:
+    """
+    List the companies of every summary and query a dashboard page can use.
+    """
+
+    return {'summary': set(model.get_firms_financial_summary()['company']),
+            'filtered': set(model.get_filtered_firms_summary(1e9, 1e9)['company']),
+            'loaded': set(model.repo.largest_companies['company'])}
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'files'])
+def test_rebuild_serves_a_new_version_without_changing_the_previous_one(project, backend):
+    from main import load_data, rebuild_data
+
+    project({'repository': {'backend': backend}})
+    st.cache_resource.clear()
+    config = get_config()
+
+    live = LiveData(load=lambda: load_data(config), rebuild=lambda: rebuild_data(config),
+                    get_paths=lambda: [], poll_interval=3600, debounce=0)
+    try:
+        first_repo, first_model = live.current
+        companies = len(first_repo.largest_companies)
+
+        append_company('input/largest_companies.csv', 'Newco')
+        live.refresh()
+        second_repo, second_model = live.current
+
+        append_company('input/largest_companies.csv', 'Newco 2')
+        live.refresh()
+        third_repo, third_model = live.current
+
+        assert live.version == 3
+        assert third_repo.backend == backend
+        assert len(third_repo.largest_companies) == companies + 2
+
+        # Pages still rendering a previous version keep all of its data, after the database was rewritten
+        for model, expected in ((first_model, set()), (second_model, {'Newco'}), (third_model, {'Newco', 'Newco 2'})):
+            for name, values in get_companies(model).items():
+                assert values & {'Newco', 'Newco 2'} == expected, name
+    finally:
+        live.watcher.stop()
@@ -1,7 +1,9 @@
+import numpy as np
 import streamlit as st
-import plotly.express as px
 import pandas as pd
 
+from configuration import Config
+
 
 class View:
     """
@@ -11,10 +13,10 @@ class View:
     methods to display various financial charts based on country and firm data.
     """
 
-    def __init__(self, config: dict):
+    def __init__(self, config: Config):
         """
          Initializes the View with the given configuration and sets Streamlit page settings.
-        :param config: A dictionary containing the application's configuration settings.
+        :param config: the application's configuration, with the precomputed rename maps.
         """
 
         self.config = config
@@ -54,25 +56,59 @@ class View:
 
         self.model = model
 
+    def get_summary(self, name: str, compute) -> pd.DataFrame:
+        """
+        Returns a summary materialized in the database by the export, served read-only by the
+        repository, or computes it with the model when it is not available.
+
+        :param name: the key of the summary table in the export_final_results section of the configuration.
+        :param compute: the Model method computing the summary.
+        :return: the summary DataFrame, which must not be modified in place.
+        """
+
+        if self.repo is not None and name in self.repo.summaries:
+            return self.repo.summaries[name]
+
+        return compute()
+
     def plot_roa_vs_efficiency(self, df: pd.DataFrame) -> None:
         """
          Displays a scatter plot of Return on Assets vs. Asset Efficiency for firms.
 
+        Above `webgl_threshold` firms, the points are drawn with WebGL and without labels; above
+        `density_threshold`, they are binned server-side into a density heatmap, so the size of the
+        chart sent to the browser does not depend on the number of firms.
         :param df: DataFrame containing company data with ROA and efficiency metrics.
         :return: none
         """
 
-        # Create scatter plot with Plotly
-        fig = px.scatter(
-            df,
-            x=self.config['firms_financial_summary_table']['asset_efficiency'],
-            y=self.config['firms_financial_summary_table']['return_on_assets'],
-            text=self.config['firms_financial_summary_table']['company'],
-            title=self.config['plot_roa_vs_efficiency']['title'],
-            labels=self.config['plot_roa_vs_efficiency']['labels']
-        )
-        # Customize marker appearance
-        fig.update_traces(marker=dict(size=10, color='green', opacity=0.7), textposition='top right')
+        # Plotly is imported on first use, it takes a noticeable part of the app start-up time
+        import plotly.express as px
+
+        plot_config = self.config['plot_roa_vs_efficiency']
+        density_threshold = plot_config['density_threshold']
+
+        if density_threshold is not None and len(df) > density_threshold:
+            fig = self.get_density_figure(df)
+        else:
+            large = len(df) > plot_config['webgl_threshold']
+
+            # Create scatter plot with Plotly
+            fig = px.scatter(
+                df,
+                x=self.config['firms_financial_summary_table']['asset_efficiency'],
+                y=self.config['firms_financial_summary_table']['return_on_assets'],
+                text=None if large else self.config['firms_financial_summary_table']['company'],
+                title=plot_config['title'],
+                labels=plot_config['labels'],
+                render_mode='webgl' if large else 'auto'
+            )
+            # Customize marker appearance
+            if large:
+                fig.update_traces(marker=dict(size=4, color='green', opacity=0.5))
+            else:
+                fig.update_traces(marker=dict(size=10, color='green', opacity=0.7), textposition='top right')
+
         fig.update_layout(width=900, height=600, title_font_size=18)
 
         # Render chart in Streamlit
@@ -81,16 +117,53 @@ class View:
         # Add custom explanatory markdown below the chart
         st.markdown(self.config['plot_roa_vs_efficiency']['markdown'])
 
+    def get_density_figure(self, df: pd.DataFrame) -> 'go.Figure':
+        """
+        Bins the firms on asset efficiency and ROA and draws the number of firms per bin.
+
+        :param df: DataFrame containing company data with ROA and efficiency metrics.
+        :return: the heatmap figure, with `density_bins` bins per axis.
+        """
+
+        import plotly.graph_objects as go
+
+        plot_config = self.config['plot_roa_vs_efficiency']
+        x = df[self.config['firms_financial_summary_table']['asset_efficiency']].to_numpy(dtype='float64')
+        y = df[self.config['firms_financial_summary_table']['return_on_assets']].to_numpy(dtype='float64')
+        finite = np.isfinite(x) & np.isfinite(y)
+
+        counts, x_edges, y_edges = np.histogram2d(x[finite], y[finite], bins=plot_config['density_bins'])
+
+        # Empty bins are left transparent
+        counts = np.where(counts > 0, counts, np.nan)
+
+        fig = go.Figure(go.Heatmap(
+            x=(x_edges[:-1] + x_edges[1:]) / 2,
+            y=(y_edges[:-1] + y_edges[1:]) / 2,
+            z=counts.T,
+            colorscale='Greens',
+            colorbar=dict(title=plot_config['density_label'])
+        ))
+        fig.update_layout(
+            title=plot_config['title'],
+            xaxis_title=plot_config['labels']['asset_efficiency'],
+            yaxis_title=plot_config['labels']['return_on_assets']
+        )
+
+        return fig
+
     def plot_top10_roa(self) -> None:
         """
         Displays a bar chart of the top 10 companies ranked by Return on Assets.
         :return: none
         """
 
-        # Get financial summary, sort by ROA, and select top 10
-        df=self.model.get_firms_financial_summary()
-        df=df.sort_values(by=self.model.firms_financial_summary_table['return_on_assets'],
-                          ascending=False).head(10).round(2)  #arrorndi car illisible
+        import plotly.express as px
+
+        # Get the top 10 firms by ROA
+        top_roa_size = self.config['export_final_results']['top_roa_size']
+        df=self.get_summary('top_roa', lambda: self.model.get_top_firms_by_roa(top_roa_size))
+        df=df.round(2)  #arrorndi car illisible
 
         # Create bar chart
         fig = px.bar(
@@ -118,17 +191,20 @@ class View:
         :return: none
         """
 
+        import plotly.express as px
+
         # Load summary data from the model
-        df=self.model.get_country_financial_summary()
+        df=self.get_summary('financial_summary_stat', self.model.get_country_financial_summary)
 
-        # Create scatter plot
+        # Create scatter plot, animated over the years in panel mode
         fig = px.scatter(
             df,
             x=self.config['countries_financial_summary_table']['average_contrib_to_pub_fin'],
             y=self.config['countries_financial_summary_table']['average_roa'],
             text=self.config['plot_contribution_vs_roa']['text'],
             title=self.config['plot_contribution_vs_roa']['title'],
-            labels=self.config['plot_contribution_vs_roa']['labels']
+            labels=self.config['plot_contribution_vs_roa']['labels'],
+            animation_frame=self.model.year
         )
 
         # Customize marker appearance
@@ -147,17 +223,14 @@ class View:
         :return: none
         """
 
-        # Get country-level data and compute correlation matrix
-        df = self.model.get_country_financial_summary()
-        df = df.set_index(self.model.countries_financial_summary_table['country'])
-        corr_df= df.corr()
+        import plotly.express as px
 
-        rename_dict = {
-            self.model.countries_financial_summary_table[key]: self.config['plot_macro_correlation_heatmap']['labels'][key]
-            for key in self.config['plot_macro_correlation_heatmap']['labels']
-        }
+        # Get the correlation matrix of the country-level data
+        corr_df = self.get_summary('macro_correlation', self.model.get_macro_correlation)
 
-        corr_df = corr_df.rename(index=rename_dict, columns=rename_dict)
+        # Rename map precomputed with the configuration
+        labels = self.config.macro_correlation_labels
+        corr_df = corr_df.rename(index=labels, columns=labels)
 
         # Create heatmap with Plotly
         fig = px.imshow(
@@ -187,14 +260,9 @@ class View:
         """
         :return: the dataset with the renamed columns
         """
-        df = self.model.get_country_financial_summary()
-
-        rename_dict = {
-            self.model.countries_financial_summary_table[key]: self.config['display_country_table'][key]
-            for key in self.config['display_country_table']
-        }
+        df = self.get_summary('financial_summary_stat', self.model.get_country_financial_summary)
 
-        return df.rename(columns=rename_dict)
+        return df.rename(columns=self.config.country_table_names)
 
 
     def display_firms_table(self) -> pd.DataFrame:
@@ -202,12 +270,7 @@ class View:
         :return: the dataset with the rename columns
         """
 
-        df = self.model.get_firms_financial_summary()
-
-        rename_dict = {
-            self.model.firms_financial_summary_table[key]: self.config['display_firms_table'][key]
-            for key in self.config['display_firms_table']
-        }
+        df = self.get_summary('firms_summary_stat', self.model.get_firms_financial_summary)
 
-        return df.rename(columns=rename_dict)
+        return df.rename(columns=self.config.firms_table_names)
 
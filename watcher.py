@@ -0,0 +1,150 @@
+"""
+This module rebuilds the dashboard data in the background when the input files change.
+
+`InputWatcher` polls the modification time and size of the input files (no inotify or network
+needed), waits until they stop changing so a file still being written is never read, and calls
+a rebuild function in its own thread. `LiveData` holds the Repository and Model served to the
+dashboard and replaces them in a single assignment once a rebuild is complete: a page being
+rendered keeps using the data it started with, and no reader ever waits for the ETL.
+"""
+
+import time
+import logging
+import threading
+
+from helpers import get_files_signature
+
+
+class InputWatcher:
+    """
+    Polls a set of files and calls a function once they have changed and stayed unchanged for
+    `debounce` seconds.
+    """
+
+    def __init__(self, get_paths, on_change, poll_interval: float, debounce: float) -> None:
+        """
+        Initialize the watcher; the current state of the files is the reference.
+
+        :param get_paths: function returning the watched paths, called on each poll so new files are seen.
+        :param on_change: function called, in the watcher thread, after the files changed.
+        :param poll_interval: the seconds between two checks of the files.
+        :param debounce: the seconds without further changes before `on_change` is called.
+        """
+
+        self.get_paths = get_paths
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+
+        self.signature = get_files_signature(self.get_paths())
+        # Signature of the files while a change is being debounced, and when it was last seen changing
+        self.pending = None
+        self.pending_since = None
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def check(self, now: float = None) -> bool:
+        """
+        Check the files once.
+
+        :param now: the current time, defaults to the monotonic clock.
+        :return: True if the files changed and have been stable for `debounce` seconds.
+        """
+
+        now = time.monotonic() if now is None else now
+        signature = get_files_signature(self.get_paths())
+
+        if signature == self.signature:
+            self.pending = None
+            return False
+
+        # Restart the debounce delay on every new write
+        if signature != self.pending:
+            self.pending = signature
+            self.pending_since = now
+            return False
+
+        if now - self.pending_since < self.debounce:
+            return False
+
+        self.signature = signature
+        self.pending = None
+        return True
+
+    def run(self) -> None:
+        """
+        Poll the files until `stop` is called, calling `on_change` after each debounced change.
+
+        Changes made while `on_change` runs are picked up by the next check.
+        :return: none
+        """
+
+        while not self.stop_event.wait(self.poll_interval):
+            if self.check():
+                logging.info('input files changed, rebuilding')
+                try:
+                    self.on_change()
+                except Exception as e:
+                    logging.error(f'rebuild failed: {e}')
+
+    def start(self) -> None:
+        """
+        Start polling in a daemon thread.
+        :return: none
+        """
+
+        self.thread = threading.Thread(target=self.run, name='input-watcher', daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop polling, waiting for a running rebuild to finish.
+        :return: none
+        """
+
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+
+class LiveData:
+    """
+    The Repository and Model served to the dashboard, replaced by a new version after each rebuild
+    triggered by an `InputWatcher`.
+    """
+
+    def __init__(self, load, rebuild, get_paths, poll_interval: float, debounce: float) -> None:
+        """
+        Load the current data and start watching the input files.
+
+        :param load: function returning the initial (Repository, Model).
+        :param rebuild: function running the pipeline and returning the new (Repository, Model),
+                        or None if it failed.
+        :param get_paths: function returning the input file paths.
+        :param poll_interval: the seconds between two checks of the input files.
+        :param debounce: the seconds without further changes before a rebuild starts.
+        """
+
+        self.rebuild = rebuild
+        self.current = load()
+        self.version = 1
+
+        self.watcher = InputWatcher(get_paths, self.refresh, poll_interval, debounce)
+        self.watcher.start()
+
+    def refresh(self) -> None:
+        """
+        Rebuild the data and serve the new version, keeping the current one if the rebuild failed.
+        :return: none
+        """
+
+        current = self.rebuild()
+        if current is None:
+            logging.error(f'rebuild failed, still serving data version {self.version}')
+            return
+
+        # A single assignment: readers get either the previous or the new pair, never a mix
+        self.current = current
+        self.version += 1
+        logging.info(f'serving data version {self.version}')